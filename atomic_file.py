@@ -0,0 +1,22 @@
+"""
+Atomic File - Replace a file so that readers see either the old or the new content
+"""
+
+import os
+
+
+def write_atomic(path: str, data: bytes):
+    """Write ``data`` to ``path`` through a temporary file and a rename.
+
+    The temporary file is named after the process, so processes writing
+    the same file at once do not interfere; the last rename wins.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
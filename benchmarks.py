@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""
+Benchmarks - Microbenchmarks for the game hot paths with regression gating
+
+Usage:
+    python benchmarks.py                   # compare with the stored baseline
+    python benchmarks.py --save-baseline   # record a new baseline
+    python benchmarks.py --tolerance 0.3   # allow 30% slowdown before failing
+
+Exits with status 1 when any benchmark is slower than its baseline by more
+than the tolerance. Each benchmark is measured next to a fixed pure-Python
+reference workload and compared as a ratio to it, so a slower or busier
+machine does not show up as a regression. A benchmark over the tolerance
+is measured again, with longer samples, before it counts as a regression:
+a burst of load on the machine can slow one measurement but rarely all.
+"""
+
+import argparse
+import asyncio
+import gc
+import itertools
+import json
+import os
+import platform
+import sys
+import time
+from typing import Callable, Dict, List, Tuple
+
+from chat_settings import GameSettings
+from config import GAME_CONFIG
+from fake_telegram import FakeContext
+from game_manager import GameManager, parse_vote_data, vote_data
+from game_state import GameKey, GameState
+from state_backend import InMemoryBackend
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks_baseline.json")
+
+KEY = GameKey(-100)
+
+# Realistic table size and a stress size
+PLAYER_COUNTS = (GAME_CONFIG["max_players"], 1000)
+
+# Further measurements of a suspected regression, each with samples this many times longer
+RECHECKS = 3
+RECHECK_SCALE = 5
+
+BENCHMARKS: Dict[str, Callable[[int], Callable[[], None]]] = {}
+
+
+def benchmark(name: str):
+    """Register a benchmark; the function builds state for n players and returns the timed operation"""
+    def register(setup: Callable[[int], Callable[[], None]]):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+def _make_game(players: int, phase: str = "registration") -> GameState:
+    game = GameState(-100, 1, "creator")
+    for user_id in range(2, players + 1):
+        game.add_player(user_id, f"player{user_id}")
+    if phase != "registration":
+        game.assign_roles()
+        game.start_discussion()
+    if phase == "voting":
+        game.start_voting()
+    return game
+
+
+def _make_manager(game: GameState) -> GameManager:
+    manager = GameManager(InMemoryBackend())
+    manager.games[game.key] = game
+    manager.leases.add(game.key)
+    manager.backend.games[game.key] = game
+    return manager
+
+
+def _run_async(coro_factory: Callable, loops: int) -> Callable[[], None]:
+    """Wrap an async operation so that one call awaits it ``loops`` times in a running loop"""
+    loop = asyncio.new_event_loop()
+
+    async def batch():
+        for _ in range(loops):
+            await coro_factory()
+
+    def run():
+        loop.run_until_complete(batch())
+    run.loops = loops
+    return run
+
+
+@benchmark("GameState.add_player")
+def bench_add_player(players: int):
+    def run():
+        game = GameState(-100, 1, "creator")
+        for user_id in range(2, players + 1):
+            game.add_player(user_id, "player")
+    run.loops = players
+    return run
+
+
+@benchmark("GameState.assign_roles")
+def bench_assign_roles(players: int):
+    game = _make_game(players)
+    return game.assign_roles
+
+
+@benchmark("GameState.all_votes_cast")
+def bench_all_votes_cast(players: int):
+    game = _make_game(players, "voting")
+    alive = list(game.players)
+    game.votes = {voter: alive[0] for voter in alive[:-1]}
+    return game.all_votes_cast
+
+
+@benchmark("GameState.get_alive_players")
+def bench_get_alive_players(players: int):
+    game = _make_game(players, "voting")
+    for player in list(game.players.values())[::3]:
+        player.alive = False
+    return game.get_alive_players
+
+
+@benchmark("GameManager.join_game")
+def bench_join_game(players: int):
+    game = _make_game(1)
+    game.settings = GameSettings.from_config({**GAME_CONFIG, "max_players": players})
+    manager = _make_manager(game)
+    creator = game.players[1]
+    users = itertools.count(2)
+
+    async def join():
+        # Start over with just the creator once the table is full
+        if len(game.players) >= players:
+            game.players = {1: creator}
+        await manager.join_game(KEY, next(users), "player")
+
+    return _run_async(join, 500)
+
+
+@benchmark("GameManager.cast_vote")
+def bench_cast_vote(players: int):
+    game = _make_game(players, "voting")
+    manager = _make_manager(game)
+    context = FakeContext()
+    voters = list(game.players)
+    state = {"i": 0}
+
+    async def vote():
+        i = state["i"] = (state["i"] + 1) % len(voters)
+        await manager.cast_vote(KEY, voters[i], voters[i - 1], context)
+
+    return _run_async(vote, 1000)
+
+
+@benchmark("GameManager.get_game_status")
+def bench_get_game_status(players: int):
+    game = _make_game(players, "voting")
+    manager = _make_manager(game)
+    voters = list(game.players)
+    game.votes = {voter: voters[0] for voter in voters[: len(voters) // 2]}
+
+    async def status():
+        await manager.get_game_status(KEY)
+
+    return _run_async(status, 1000)
+
+
+@benchmark("parse_vote_data")
+def bench_parse_vote_data(players: int):
+    payloads = [vote_data(0, user_id) for user_id in range(1, players + 1)] + ["vote_x", "set_reg_time"]
+
+    def run():
+        for data in payloads:
+            parse_vote_data(data)
+    run.loops = len(payloads)
+    return run
+
+
+def reference_workload():
+    """Fixed interpreter-bound workload used to normalize results"""
+    table = {i: (i, i % 3 == 0) for i in range(200)}
+    return len([key for key, (_, flag) in table.items() if flag])
+
+
+def _calibrate(operation: Callable[[], None], sample_time: float) -> int:
+    """Number of calls that take about ``sample_time``"""
+    calls = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(calls):
+            operation()
+        if time.perf_counter() - start >= sample_time or calls >= 1 << 20:
+            return calls
+        calls *= 2
+
+
+def _sample(operation: Callable[[], None], calls: int) -> float:
+    """Seconds per operation over one batch of calls"""
+    start = time.perf_counter()
+    for _ in range(calls):
+        operation()
+    return (time.perf_counter() - start) / (calls * getattr(operation, "loops", 1))
+
+
+def measure(operation: Callable[[], None], repeats: int = 15, sample_time: float = 0.02) -> Tuple[float, float]:
+    """Best time per operation in nanoseconds, and best time of the reference workload.
+
+    Samples of the operation and of the reference workload are interleaved
+    so both see the same machine load, and the minimum of each is kept, as
+    with timeit: noise from other processes only ever adds time.
+    """
+    calls = _calibrate(operation, sample_time)
+    reference_calls = _calibrate(reference_workload, sample_time)
+
+    best, best_reference = float("inf"), float("inf")
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeats):
+            best_reference = min(best_reference, _sample(reference_workload, reference_calls))
+            best = min(best, _sample(operation, calls))
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    return best * 1e9, best_reference * 1e9
+
+
+def _result(name: str, players: int, scale: int = 1) -> dict:
+    ns, reference = measure(BENCHMARKS[name](players), sample_time=0.02 * scale)
+    return {"ns": round(ns, 1), "relative": round(ns / reference, 4)}
+
+
+def run_all(selected: List[str]) -> Dict[str, dict]:
+    """Run benchmarks; each result holds ns/op and its ratio to the reference workload"""
+    results = {}
+    for name in BENCHMARKS:
+        if selected and not any(s in name for s in selected):
+            continue
+        for players in PLAYER_COUNTS:
+            key = f"{name}[{players}]"
+            results[key] = result = _result(name, players)
+            print(f"{key:<40} {result['ns']:>12.1f} ns/op {result['relative']:>10.3f} x ref", flush=True)
+    return results
+
+
+def recheck(suspects: List[str], results: Dict[str, dict], baseline: Dict[str, dict],
+            tolerance: float) -> List[str]:
+    """Measure suspected regressions again and keep each one's best result; returns the ones that stay slow"""
+    confirmed = []
+    for key in suspects:
+        name, _, players = key.rpartition("[")
+        limit = baseline[key]["relative"] * (1 + tolerance)
+        for attempt in range(1, RECHECKS + 1):
+            result = _result(name, int(players[:-1]), RECHECK_SCALE)
+            if result["relative"] < results[key]["relative"]:
+                results[key] = result
+            print(f"{key:<40} recheck {attempt}: {result['relative']:.3f} x ref "
+                  f"(limit {limit:.3f})", flush=True)
+            if results[key]["relative"] <= limit:
+                break
+        else:
+            confirmed.append(key)
+    return confirmed
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float) -> List[str]:
+    """Names of benchmarks slower than baseline by more than the tolerance"""
+    regressions = []
+    print(f"\n{'benchmark':<40} {'baseline':>10} {'current':>10} {'change':>8}  (x reference)")
+    for key, current in results.items():
+        previous = baseline.get(key)
+        if previous is None:
+            print(f"{key:<40} {'-':>10} {current['relative']:>10.3f}      new")
+            continue
+        change = current["relative"] / previous["relative"] - 1
+        marker = "  REGRESSION" if change > tolerance else ""
+        print(f"{key:<40} {previous['relative']:>10.3f} {current['relative']:>10.3f} {change:>+7.0%}{marker}")
+        if change > tolerance:
+            regressions.append(key)
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark game hot paths")
+    parser.add_argument("--save-baseline", action="store_true", help="store results as the new baseline")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="baseline file path")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown, 0.25 = 25%%")
+    parser.add_argument("filter", nargs="*", help="only run benchmarks whose name contains one of these")
+    args = parser.parse_args()
+
+    results = run_all(args.filter)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump({
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "results": results,
+            }, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"\nBaseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"\nNo baseline at {args.baseline}; run with --save-baseline first")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)["results"]
+    suspects = compare(results, baseline, args.tolerance)
+    if suspects:
+        print(f"\nMeasuring {len(suspects)} suspected regression(s) again")
+    regressions = recheck(suspects, results, baseline, args.tolerance)
+    if regressions:
+        print(f"\n{len(regressions)} benchmark(s) regressed beyond {args.tolerance:.0%}: {', '.join(regressions)}")
+        return 1
+    print("\nNo regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,328 @@
+"""
+Broadcast - Admin messages to every chat with a running game, resumable after a restart
+
+A broadcast has its text, the game phases it targets and a delivery status
+for each targeted game: pending, sent, gone (the chat or topic can no
+longer be posted to) or failed. Workers send at a fixed rate, with a
+bounded number of sends in flight, through the outbound limiter that also
+paces game messages, so no chat goes past its send limit. The status is
+written to a JSON file every few seconds and when the broadcast stops. A
+restarted process, or one that took the games over, resumes the
+deliveries still pending. A message sent just before a crash, before its
+status was written, is sent again. With a shared backend, a broadcast
+reaches the games driven by the instance it was started on.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import threading
+import time
+import uuid
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Tuple
+
+from atomic_file import write_atomic
+from config import BROADCAST_CONFIG
+from game_state import GameKey
+from logging_setup import key_fields
+from rate_limit import TokenBucketLimiter
+
+if TYPE_CHECKING:
+    from telegram.ext import ContextTypes
+
+    from game_manager import GameManager
+
+logger = logging.getLogger(__name__)
+
+# Phases a broadcast can target; games that ended are never messaged
+PHASES = ("registration", "discussion", "voting")
+
+STATUSES = ("pending", "sent", "gone", "failed")
+
+
+def parse_command(text: str) -> Tuple[Tuple[str, ...], str]:
+    """Phases and message of a /broadcast argument: an optional comma-separated phase list, then the text"""
+    words = text.split(None, 1)
+    if words and all(name in PHASES for name in words[0].split(",")):
+        names = words[0].split(",")
+        return tuple(name for name in PHASES if name in names), words[1].strip() if len(words) > 1 else ""
+    return PHASES, text.strip()
+
+
+class Broadcast:
+    """One broadcast and the delivery status of each game it targets"""
+
+    def __init__(self, text: str, phases: Iterable[str], admin: GameKey, targets: Iterable[GameKey]):
+        self.id = uuid.uuid4().hex[:8]
+        self.text = text
+        self.phases = tuple(phases)
+        self.admin = admin  # Chat and topic progress is reported to
+        self.created = time.time()
+        self.stopped = False
+        self.status: Dict[GameKey, str] = {key: "pending" for key in targets}
+        self.errors: Dict[GameKey, str] = {}
+        self.progress_message_id: Optional[int] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.stopped or all(status != "pending" for status in self.status.values())
+
+    def pending(self) -> List[GameKey]:
+        return [key for key, status in self.status.items() if status == "pending"]
+
+    def counts(self) -> Dict[str, int]:
+        counts = dict.fromkeys(STATUSES, 0)
+        for status in self.status.values():
+            counts[status] += 1
+        return counts
+
+    def progress_text(self) -> str:
+        """Progress report for the admin"""
+        counts = self.counts()
+        text = (
+            f"📣 Рассылка {self.id} ({', '.join(self.phases)}): "
+            f"доставлено {counts['sent']} из {len(self.status)}"
+        )
+        if counts["gone"]:
+            text += f", недоступно {counts['gone']}"
+        if counts["failed"]:
+            text += f", ошибок {counts['failed']}"
+        if self.stopped:
+            text += f"\n⏹ Остановлена, не отправлено: {counts['pending']}"
+        elif counts["pending"]:
+            text += f"\n⏳ В очереди: {counts['pending']}"
+        else:
+            text += "\n✅ Завершена"
+        return text
+
+    def to_dict(self) -> dict:
+        """Serialize the broadcast to JSON-compatible data"""
+        return {
+            "id": self.id,
+            "text": self.text,
+            "phases": list(self.phases),
+            "admin": str(self.admin),
+            "created": self.created,
+            "stopped": self.stopped,
+            "progress_message_id": self.progress_message_id,
+            "status": {str(key): status for key, status in self.status.items()},
+            "errors": {str(key): error for key, error in self.errors.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Broadcast":
+        """Restore a broadcast from ``to_dict`` output"""
+        broadcast = cls.__new__(cls)
+        broadcast.id = data["id"]
+        broadcast.text = data["text"]
+        broadcast.phases = tuple(data["phases"])
+        broadcast.admin = GameKey.parse(data["admin"])
+        broadcast.created = data["created"]
+        broadcast.stopped = data["stopped"]
+        broadcast.progress_message_id = data.get("progress_message_id")
+        broadcast.status = {GameKey.parse(key): status for key, status in data["status"].items()}
+        broadcast.errors = {GameKey.parse(key): error for key, error in data["errors"].items()}
+        return broadcast
+
+
+class Broadcaster:
+    """Runs one broadcast at a time and keeps its delivery status on disk"""
+
+    def __init__(self, manager: GameManager, config: Optional[dict] = None):
+        config = config or BROADCAST_CONFIG
+        self.manager = manager
+        self.path = config["file"]
+        self.concurrency = config["concurrency"]
+        self.attempts = config["attempts"]
+        self.flush_interval = config["flush_interval"]
+        self.progress_interval = config["progress_interval"]
+        self.pacer = TokenBucketLimiter(config["rate"], 1, 1)
+        self.current: Optional[Broadcast] = None
+        self._task: Optional[asyncio.Task] = None
+        self._dirty = False
+        self._write_lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self, text: str, phases: Iterable[str], admin: GameKey,
+              context: ContextTypes.DEFAULT_TYPE) -> Broadcast:
+        """Start a broadcast to the games in the given phases"""
+        if self.running:
+            raise RuntimeError("A broadcast is already running")
+        phases = tuple(phases)
+        # Only the games this instance drives: their phase changes here, so the local state is current
+        targets = []
+        for key in self.manager.leases:
+            game = self.manager.get_game(key)
+            if game is not None and game.phase in phases:
+                targets.append(key)
+        self.current = Broadcast(text, phases, admin, targets)
+        self._dirty = True
+        self._task = asyncio.create_task(self._run(self.current, context))
+        return self.current
+
+    async def resume(self, context: ContextTypes.DEFAULT_TYPE) -> Optional[Broadcast]:
+        """Continue the stored broadcast if it did not finish"""
+        broadcast = self.load()
+        if broadcast is None or broadcast.finished:
+            return None
+        self.current = broadcast
+        logger.info("Resuming broadcast %s with %s pending chats", broadcast.id, len(broadcast.pending()))
+        self._task = asyncio.create_task(self._run(broadcast, context))
+        return broadcast
+
+    async def stop(self) -> Optional[Broadcast]:
+        """Stop the running broadcast for good; it is not resumed"""
+        broadcast = self.current
+        if broadcast is None or not self.running:
+            return None
+        broadcast.stopped = True
+        self._dirty = True
+        await self._cancel()
+        return broadcast
+
+    async def close(self):
+        """Stop sending and write the delivery status, so another process can resume"""
+        await self._cancel()
+        self.flush()
+
+    async def _cancel(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self, broadcast: Broadcast, context: ContextTypes.DEFAULT_TYPE):
+        queue: asyncio.Queue = asyncio.Queue()
+        for key in broadcast.pending():
+            queue.put_nowait(key)
+
+        await self._report(broadcast, context)
+        workers = [
+            asyncio.create_task(self._worker(queue, broadcast, context))
+            for _ in range(min(self.concurrency, queue.qsize()))
+        ]
+        background = [
+            asyncio.create_task(self._flush_loop()),
+            asyncio.create_task(self._report_loop(broadcast, context)),
+        ]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers + background:
+                task.cancel()
+            await asyncio.gather(*workers, *background, return_exceptions=True)
+            self._dirty = True
+            self.flush()
+            # Also report a stop, but not a close for a handover: the next process reports then
+            if broadcast.finished:
+                await self._report(broadcast, context)
+                logger.info("Broadcast %s finished: %s", broadcast.id, broadcast.counts())
+
+    async def _worker(self, queue: asyncio.Queue, broadcast: Broadcast, context: ContextTypes.DEFAULT_TYPE):
+        while not queue.empty():
+            key = queue.get_nowait()
+            await asyncio.sleep(self.pacer.reserve("broadcast"))
+            broadcast.status[key] = await self._deliver(key, broadcast, context)
+            self._dirty = True
+
+    async def _deliver(self, key: GameKey, broadcast: Broadcast, context: ContextTypes.DEFAULT_TYPE) -> str:
+        """Send the broadcast to one game; returns its delivery status"""
+        from telegram.error import BadRequest, NetworkError, RetryAfter, TelegramError
+
+        for attempt in range(1, self.attempts + 1):
+            try:
+                if not await self.manager.announce(key, context, broadcast.text):
+                    return "gone"
+                broadcast.errors.pop(key, None)
+                return "sent"
+            except RetryAfter as e:
+                broadcast.errors[key] = str(e)
+                await asyncio.sleep(e.retry_after)
+            except BadRequest as e:
+                broadcast.errors[key] = str(e)
+                break
+            except NetworkError as e:
+                broadcast.errors[key] = str(e)
+                await asyncio.sleep(attempt)
+            except TelegramError as e:
+                broadcast.errors[key] = str(e)
+                break
+            except Exception as e:
+                logger.error("Error delivering broadcast %s: %s", broadcast.id, e, extra=key_fields(key))
+                broadcast.errors[key] = str(e)
+                break
+        logger.warning("Broadcast %s not delivered: %s", broadcast.id, broadcast.errors.get(key), extra=key_fields(key))
+        return "failed"
+
+    async def _report(self, broadcast: Broadcast, context: ContextTypes.DEFAULT_TYPE):
+        """Send or update the progress message in the admin's chat"""
+        from telegram.error import TelegramError
+
+        text = broadcast.progress_text()
+        admin = broadcast.admin
+        try:
+            if broadcast.progress_message_id is None:
+                message = await context.bot.send_message(
+                    admin.chat_id, text, message_thread_id=admin.thread_id or None
+                )
+                broadcast.progress_message_id = message.message_id
+                self._dirty = True
+            else:
+                await context.bot.edit_message_text(
+                    text, chat_id=admin.chat_id, message_id=broadcast.progress_message_id
+                )
+        except TelegramError as e:
+            # "Message is not modified" when nothing was delivered since the last report
+            logger.debug("Could not report broadcast progress: %s", e)
+
+    async def _report_loop(self, broadcast: Broadcast, context: ContextTypes.DEFAULT_TYPE):
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            await self._report(broadcast, context)
+
+    # Storage
+
+    def load(self) -> Optional[Broadcast]:
+        """Read the stored broadcast, if any"""
+        try:
+            with open(self.path, "rb") as f:
+                return Broadcast.from_dict(json.load(f))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            logger.error("Could not read broadcast state from %s: %s", self.path, e)
+            return None
+
+    def _write_snapshot(self, data: dict):
+        with self._write_lock:
+            write_atomic(self.path, json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode())
+
+    def flush(self) -> bool:
+        """Write the delivery status now if it changed"""
+        if not self._dirty or self.current is None:
+            return False
+        self._dirty = False
+        try:
+            self._write_snapshot(self.current.to_dict())
+        except OSError as e:
+            logger.error("Could not write broadcast state to %s: %s", self.path, e)
+        return True
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            if not self._dirty:
+                continue
+            # The snapshot is taken on the event loop, so workers cannot change it while it is written
+            self._dirty = False
+            data = self.current.to_dict()
+            try:
+                await asyncio.to_thread(self._write_snapshot, data)
+            except OSError as e:
+                self._dirty = True
+                logger.error("Could not write broadcast state to %s: %s", self.path, e)
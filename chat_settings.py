@@ -0,0 +1,189 @@
+"""
+Chat Settings - Per-chat game settings layered over the GAME_CONFIG defaults
+"""
+
+import asyncio
+import dataclasses
+import json
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+from atomic_file import write_atomic
+from config import GAME_CONFIG, SETTINGS_CONFIG
+
+logger = logging.getLogger(__name__)
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class GameSettings:
+    """Settings a game runs with, resolved once when the game is created"""
+    min_players: int
+    max_players: int
+    registration_time: int
+    discussion_time: int
+    voting_time: int
+    enable_taunts: bool
+    taunt_frequency: int
+    ready_quorum: float
+
+    @classmethod
+    def from_config(cls, config: Optional[dict] = None) -> "GameSettings":
+        """Settings with the values of a GAME_CONFIG-style dict"""
+        config = config or GAME_CONFIG
+        return cls(**{name: config[name] for name in SETTING_NAMES})
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in SETTING_NAMES}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "GameSettings":
+        """Settings from ``to_dict`` output, maybe of another version: unknown names are dropped,
+        missing ones take their defaults"""
+        known = {name: value for name, value in data.items() if name in SETTING_NAMES}
+        return dataclasses.replace(default_settings(), **known)
+
+
+SETTING_NAMES = tuple(field.name for field in dataclasses.fields(GameSettings))
+
+_default_settings: Optional[GameSettings] = None
+
+
+def default_settings() -> GameSettings:
+    """Settings from GAME_CONFIG, built on first use and shared by every game without overrides"""
+    global _default_settings
+    if _default_settings is None:
+        _default_settings = GameSettings.from_config()
+    return _default_settings
+
+
+def next_value(settings: GameSettings, name: str, player_count: int = 0) -> Any:
+    """Value a settings button switches to from the current one"""
+    if name == "enable_taunts":
+        return not settings.enable_taunts
+
+    choices = SETTINGS_CONFIG["choices"][name]
+    if name == "min_players":
+        choices = [c for c in choices if c <= settings.max_players]
+    elif name == "max_players":
+        choices = [c for c in choices if c >= max(settings.min_players, player_count)]
+    if not choices:
+        return getattr(settings, name)
+
+    current = getattr(settings, name)
+    return next((c for c in choices if c > current), choices[0])
+
+
+class ChatSettingsStore:
+    """Per-chat overrides of the default settings.
+
+    A chat keeps only the values it changed, in a small dict that is
+    replaced rather than modified on every change; chats without changes
+    have no entry and share one default ``GameSettings``. Changes are
+    written to a single JSON file in batches from a background thread; a
+    shallow copy of the overlays is a consistent snapshot to write from.
+    """
+
+    def __init__(self, path: Optional[str] = None, defaults: Optional[dict] = None):
+        self.path = path or SETTINGS_CONFIG["file"]
+        self.defaults = GameSettings.from_config(defaults)
+        self.overlays: Dict[int, Dict[str, Any]] = {}
+        self._resolved: Dict[int, GameSettings] = {}
+        self._dirty = False
+        self._flush_task: Optional[asyncio.Task] = None
+        self._write_lock = threading.Lock()
+
+    def resolve(self, chat_id: int) -> GameSettings:
+        """Settings for a new game in the chat"""
+        overlay = self.overlays.get(chat_id)
+        if overlay is None:
+            return self.defaults
+        settings = self._resolved.get(chat_id)
+        if settings is None:
+            settings = self._resolved[chat_id] = dataclasses.replace(self.defaults, **overlay)
+        return settings
+
+    def update(self, chat_id: int, name: str, value: Any) -> GameSettings:
+        """Change one setting of a chat and return its new settings"""
+        if name not in SETTING_NAMES:
+            raise KeyError(name)
+
+        overlay = dict(self.overlays.get(chat_id, ()))
+        if value == getattr(self.defaults, name):
+            overlay.pop(name, None)
+        else:
+            overlay[name] = value
+        if overlay:
+            self.overlays[chat_id] = overlay
+        else:
+            self.overlays.pop(chat_id, None)
+
+        self._resolved.pop(chat_id, None)
+        self._dirty = True
+        return self.resolve(chat_id)
+
+    def load(self) -> int:
+        """Read stored settings, replacing the ones in memory; returns the number of chats"""
+        try:
+            with open(self.path, "rb") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return 0
+        except (OSError, ValueError) as e:
+            logger.error("Could not read chat settings from %s: %s", self.path, e)
+            return 0
+
+        # Settings that no longer exist are dropped
+        overlays = {}
+        for chat_id, overlay in data.get("chats", {}).items():
+            overlay = {name: value for name, value in overlay.items() if name in SETTING_NAMES}
+            if overlay:
+                overlays[int(chat_id)] = overlay
+        self.overlays = overlays
+        self._resolved.clear()
+        self._dirty = False
+        return len(overlays)
+
+    def _write(self):
+        """Write the current settings; the snapshot is taken under the lock so the last write is the newest"""
+        with self._write_lock:
+            self._write_snapshot(dict(self.overlays))
+
+    def _write_snapshot(self, overlays: Dict[int, Dict[str, Any]]):
+        write_atomic(self.path, json.dumps({"version": 1, "chats": overlays}, separators=(",", ":")).encode())
+
+    def flush(self) -> bool:
+        """Write the settings now if anything changed"""
+        if not self._dirty:
+            return False
+        self._dirty = False
+        self._write()
+        return True
+
+    async def _flush_loop(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            if not self._dirty:
+                continue
+            self._dirty = False
+            try:
+                await asyncio.to_thread(self._write)
+            except OSError as e:
+                self._dirty = True
+                logger.error("Could not write chat settings to %s: %s", self.path, e)
+
+    def start(self, interval: Optional[float] = None):
+        """Start writing changes in the background"""
+        if self._flush_task is None:
+            interval = interval or SETTINGS_CONFIG["flush_interval"]
+            self._flush_task = asyncio.create_task(self._flush_loop(interval))
+
+    def close(self):
+        """Stop the background writes and write pending changes"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        try:
+            self.flush()
+        except OSError as e:
+            logger.error("Could not write chat settings to %s: %s", self.path, e)
@@ -11,80 +11,95 @@ GAME_CONFIG = {
     "voting_time": 120,        # 2 minutes in seconds
     "enable_taunts": True,     # Enable character taunts during game
     "taunt_frequency": 30,     # Seconds between taunts
+    "ready_quorum": 2 / 3,     # Share of alive players whose "ready" ends the discussion early
 }
 
-# Character roles
-ROLES = [
-    "Хитрый Барыга",
-    "Ебальник Пояльник", 
-    "Чайка Виноватая",
-    "Джин Солёной Лампы",
-    "ПросящийХапку",
-    "Охотник за Бледным",
-    "Бакопор Внезапный",
-    "Собака, Съевшая Товар"
-]
+# Logging pipeline
+LOGGING_CONFIG = {
+    "level": "INFO",
+    "file": "logs/bot.log",      # JSON lines, rotated by size
+    "max_bytes": 5 * 1024 * 1024,
+    "backup_count": 5,
+    "queue_size": 10000,         # Records beyond this are dropped, not blocked on
+    "sample_window": 60,         # Seconds per sampling window for repeated errors
+    "sample_burst": 5,           # Identical errors let through per window
+}
+
+# Negative cache of recipients the bot cannot message
+REACHABILITY_CONFIG = {
+    "user_ttl": 6 * 3600,        # Users who never opened a private chat with the bot
+    "chat_ttl": 24 * 3600,       # Chats the bot was removed from
+    "max_entries": 100000,
+}
+
+# Inbound flood control, per user in each chat
+FLOOD_CONFIG = {
+    "rate": 0.5,                 # Commands and button taps per second, sustained
+    "burst": 5,                  # Taps allowed back to back
+    "callback_debounce": 2.0,    # Seconds during which a repeated identical tap is ignored
+    "max_entries": 1000000,      # Hard cap on tracked keys
+}
+
+# Outgoing message pacing under Telegram's send limits
+OUTBOUND_CONFIG = {
+    "chat_rate": 15 / 60,        # Messages per second to one group, all of its topics together
+    "chat_burst": 3,             # Back to back; with the rate, at most 18 of the allowed 20 in any minute
+    "global_rate": 25,           # Messages per second across all chats
+    "global_burst": 5,
+    "optional_backlog": 10,      # Seconds of queued sends after which taunts and reminders are skipped
+    "max_entries": 100000,       # Hard cap on tracked chats
+}
+
+# Shared game state for running several bot instances
+STATE_CONFIG = {
+    "backend": "memory",         # "memory" for a single instance, "redis" to share games
+    "redis_url": "redis://127.0.0.1:6379/0",
+    "key_prefix": "rat:",
+    "lease_ttl": 15,             # Seconds before another instance may take over a game
+    "poll_interval": 2,          # Seconds between checks for ready presses and votes taken by other instances
+}
+
+# Handing live games over to a new process during a rolling restart
+HANDOFF_CONFIG = {
+    "socket": "run/handoff.sock",  # The new process listens here
+    "file": "run/handoff.json",    # Fallback when no new process is listening
+    "timeout": 30,                 # Seconds the new process waits for the old one
+}
+
+# Per-game trace spans for finding slow phases and API calls
+TRACING_CONFIG = {
+    "file": "logs/traces.jsonl",
+    "sample_rate": 0.1,          # Share of games traced
+    "buffer_size": 10000,        # Finished spans kept in memory between writes
+    "flush_interval": 5,         # Seconds between writes
+    "max_bytes": 20 * 1024 * 1024,  # The file is rotated once past this size
+}
+
+# Per-chat settings changed with /settings
+SETTINGS_CONFIG = {
+    "file": "data/chat_settings.json",
+    "flush_interval": 10,        # Seconds between writes of changed settings
+    "choices": {                 # Values the settings buttons cycle through
+        "registration_time": (60, 120, 180, 300),
+        "min_players": (3, 4, 5, 6),
+        "max_players": (6, 8, 10, 15, 20),
+    },
+}
 
-# Bot messages
-BOT_MESSAGES = {
-    "game_started": (
-        "🎮 Начинаем новую игру! Нужны торчки! Жми /join чтобы вступить.\n"
-        "⏰ Осталось времени: {time_left}\n"
-        "👥 Игроков: {player_count}"
-    ),
-    "player_joined": "✅ {username} присоединился к игре! Игроков: {player_count}",
-    "registration_ending": "⏰ Регистрация заканчивается через {time_left}! Игроков: {player_count}",
-    "game_starting": "✅ Игра начинается! Роли выданы.",
-    "discussion_started": "💬 Обсуждение началось! У вас 2 минуты.",
-    "voting_started": "🗳️ Голосование! Кто по-твоему крыса? У тебя 2 минуты.",
-    "player_eliminated": "🔪 Большинство решило — закопать @{username}.",
-    "rat_found": "🎯 Крыса была угадана! Молодцы.",
-    "rat_not_found": "🐀 Это была не крыса... Крыса среди нас.",
-    "rat_wins": "🏆 Крыса победила! Слишком мало игроков осталось.",
+# Compiled static game texts shared by all bot processes
+CONTENT_CONFIG = {
+    "file": "data/content.bin",  # Built from content.py and scenarios.py when missing or older
+    "cache_size": 64,            # Decoded texts kept in memory per process
 }
 
-# Character taunts for entertainment during game
-CHARACTER_TAUNTS = {
-    "Хитрый Барыга": [
-        "Эй Барыга, не забудь проверить карманы - там твоя честность осталась!",
-        "Барыга, товар не продашь, если сам весь употребишь!",
-        "Хитрый говоришь? А выглядишь как пойманный с поличным!"
-    ],
-    "Ебальник Пояльник": [
-        "Ебальник, может хватит трепаться и дело делать пора?",
-        "Пояльник, язык твой работает быстрее мозга!",
-        "Эй болтун, слова на ветер не бросай - могут вернуться бумерангом!"
-    ],
-    "Чайка Виноватая": [
-        "Чайка, ты и правда виноватая или просто так называешься?",
-        "Виноватая Чайка всегда найдет, в чем покаяться!",
-        "Чайка, не кружи над головой - садись и отвечай!"
-    ],
-    "Джин Солёной Лампы": [
-        "Алладин, не пора ли тебе лампу протирать?",
-        "Джин, три желания есть, а четвертое - не попасться!",
-        "Солёная лампа? А что, сладкую уже обыскали?"
-    ],
-    "ПросящийХапку": [
-        "Эй, Просящий, может сам заработаешь на хапку?",
-        "Хапку просишь? А совесть дома не забыл?",
-        "Всегда просишь, а когда давать будешь?"
-    ],
-    "Охотник за Бледным": [
-        "Охотник, на себя в зеркало смотрел? Сам бледный как мел!",
-        "За бледным охотишься? Так ты его уже поймал - в зеркале!",
-        "Охотник говоришь? А выглядишь как добыча!"
-    ],
-    "Бакопор Внезапный": [
-        "Бакопор, твоя внезапность предсказуема как рассвет!",
-        "Внезапный? Да ты как телеграмма - всегда с опозданием!",
-        "Бакопор, порхаешь как бабочка, а жалишь как комар!"
-    ],
-    "Собака, Съевшая Товар": [
-        "Эй Собака, за пятку шмали дашь лапу?",
-        "Собака, товар съела или просто так лаешь?",
-        "Хороший мальчик! А теперь отрыгни товар обратно!"
-    ]
+# Admin broadcasts to every chat with a running game (/broadcast)
+BROADCAST_CONFIG = {
+    "file": "data/broadcast.json",  # Delivery status, so a restart resumes where it stopped
+    "rate": 5,                   # Messages per second, leaving room under the global send rate
+    "concurrency": 4,            # Sends in flight at once
+    "attempts": 3,               # Tries per chat on network errors and flood waits
+    "flush_interval": 2,         # Seconds between writes of the delivery status
+    "progress_interval": 10,     # Seconds between progress updates to the admin
 }
 
 # Admin user IDs (hidden cheats)
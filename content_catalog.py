@@ -0,0 +1,258 @@
+"""
+Content Catalog - Static game texts compiled into one memory-mapped file
+
+``build`` compiles the roles, bot messages and taunts of content.py and
+the scenario texts of scenarios.py into a single indexed binary file.
+Every bot process maps that file read-only, so all of them share one copy
+in the page cache. A text is decoded from UTF-8 only when it is used, and
+a small LRU keeps the most used ones decoded. The content sources are
+imported only by the build.
+
+Texts are stored in groups of one or more entries:
+    roles                  character roles, in ROLES order
+    scenarios              discussion scenarios
+    message/<name>         one BOT_MESSAGES text
+    taunts/<role>          taunts of a character
+
+File layout, little-endian:
+    header     magic, format version, group count, entry count
+    groups     per group: name offset, name length, first entry, entry count
+    offsets    entry count + 1 offsets of the entries in the data section
+    data       group names, then the entries, all UTF-8
+
+Usage:
+    python content_catalog.py              # build the catalog file
+    python content_catalog.py --list       # groups and sizes of the built file
+"""
+
+import logging
+import mmap
+import os
+import random
+import struct
+import sys
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple, Union
+
+from atomic_file import write_atomic
+from config import CONTENT_CONFIG
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"RCAT"
+VERSION = 1
+
+_HEADER = struct.Struct("<4sIII")
+_GROUP = struct.Struct("<IIII")
+_SPAN = struct.Struct("<II")  # Start and end of one entry, read from two neighbouring offsets
+
+# The catalog is rebuilt when any of these is newer than the file
+_SOURCES = ("content.py", "scenarios.py", "content_catalog.py")
+
+
+def collect() -> Dict[str, List[str]]:
+    """Texts of the content sources by group, in catalog order"""
+    import content
+    from scenarios import ScenarioManager
+
+    groups = {"roles": list(content.ROLES)}
+    groups["scenarios"] = [scenario() for scenario in ScenarioManager().scenarios]
+    for name, text in content.BOT_MESSAGES.items():
+        groups[f"message/{name}"] = [text]
+    for role, taunts in content.CHARACTER_TAUNTS.items():
+        groups[f"taunts/{role}"] = list(taunts)
+    return groups
+
+
+def compile_catalog(groups: Dict[str, List[str]]) -> bytes:
+    """Binary catalog of the given groups"""
+    data = bytearray()
+    names = []
+    for name in groups:
+        encoded = name.encode("utf-8")
+        names.append((len(data), len(encoded)))
+        data += encoded
+
+    group_table = bytearray()
+    offsets = []
+    first = 0
+    for (name_offset, name_length), texts in zip(names, groups.values()):
+        group_table += _GROUP.pack(name_offset, name_length, first, len(texts))
+        for text in texts:
+            offsets.append(len(data))
+            data += text.encode("utf-8")
+        first += len(texts)
+    offsets.append(len(data))
+
+    header = _HEADER.pack(MAGIC, VERSION, len(groups), first)
+    return b"".join((header, bytes(group_table), struct.pack(f"<{len(offsets)}I", *offsets), bytes(data)))
+
+
+def build(path: Optional[str] = None) -> int:
+    """Compile the content sources into the catalog file; returns its size in bytes"""
+    path = path or CONTENT_CONFIG["file"]
+    blob = compile_catalog(collect())
+    # Processes starting together may all build; the last one to finish wins
+    write_atomic(path, blob)
+    return len(blob)
+
+
+def is_stale(path: str) -> bool:
+    """Check whether the catalog file is missing or older than its sources"""
+    try:
+        built = os.stat(path).st_mtime
+    except FileNotFoundError:
+        return True
+    here = os.path.dirname(os.path.abspath(__file__))
+    for source in _SOURCES:
+        try:
+            if os.stat(os.path.join(here, source)).st_mtime > built:
+                return True
+        except FileNotFoundError:
+            continue  # Deployed without sources: the built file is all there is
+    return False
+
+
+class ContentCatalog:
+    """Read-only view of a catalog file.
+
+    Opening the file reads only the header and the group names; entries
+    are decoded when they are asked for.
+    """
+
+    def __init__(self, path: str, cache_size: int = 64):
+        self.path = path
+        self.cache_size = cache_size
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            magic, version, group_count, entry_count = _HEADER.unpack_from(self._map, 0)
+        except struct.error:
+            magic, version = None, None
+        if magic != MAGIC or version != VERSION:
+            self._map.close()
+            raise ValueError(f"{path} is not a version {VERSION} content catalog")
+
+        self._offsets = _HEADER.size + group_count * _GROUP.size
+        self._data = self._offsets + (entry_count + 1) * 4
+        self._groups: Dict[str, Tuple[int, int]] = {}  # name -> first entry, entry count
+        for i in range(group_count):
+            name_offset, name_length, first, count = _GROUP.unpack_from(self._map, _HEADER.size + i * _GROUP.size)
+            start = self._data + name_offset
+            self._groups[str(self._map[start:start + name_length], "utf-8")] = (first, count)
+        # Entry index -> text, and group name -> texts of groups read as a whole
+        self._cache: "OrderedDict[Union[int, str], Union[str, Tuple[str, ...]]]" = OrderedDict()
+
+    def _read(self, index: int) -> str:
+        start, end = _SPAN.unpack_from(self._map, self._offsets + index * 4)
+        return str(self._map[self._data + start:self._data + end], "utf-8")
+
+    def _remember(self, key: Union[int, str], value: Union[str, Tuple[str, ...]]):
+        self._cache[key] = value
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _entry(self, index: int) -> str:
+        text = self._cache.get(index)
+        if text is not None:
+            self._cache.move_to_end(index)
+            return text
+
+        text = self._read(index)
+        self._remember(index, text)
+        return text
+
+    def __contains__(self, group: str) -> bool:
+        return group in self._groups
+
+    def groups(self) -> List[str]:
+        return list(self._groups)
+
+    def count(self, group: str) -> int:
+        """Number of entries in a group, 0 if there is no such group"""
+        return self._groups.get(group, (0, 0))[1]
+
+    def get(self, group: str, index: int = 0) -> str:
+        """One entry of a group"""
+        first, count = self._groups[group]
+        if not 0 <= index < count:
+            raise IndexError(f"{group} has {count} entries")
+        return self._entry(first + index)
+
+    def items(self, group: str) -> List[str]:
+        """All entries of a group; the group is cached as a whole, like one entry"""
+        texts = self._cache.get(group)
+        if texts is not None:
+            self._cache.move_to_end(group)
+            return list(texts)
+
+        first, count = self._groups[group]
+        texts = tuple(self._read(i) for i in range(first, first + count))
+        self._remember(group, texts)
+        return list(texts)
+
+    def choice(self, group: str) -> str:
+        """A random entry of a group"""
+        first, count = self._groups[group]
+        return self._entry(first + random.randrange(count))
+
+    def message(self, name: str) -> str:
+        """A bot message, as BOT_MESSAGES[name]"""
+        return self.get(f"message/{name}")
+
+    def close(self):
+        self._cache.clear()
+        self._map.close()
+
+
+def open_catalog(path: Optional[str] = None, cache_size: Optional[int] = None) -> ContentCatalog:
+    """Open the catalog file, building it first if it is missing or out of date"""
+    path = path or CONTENT_CONFIG["file"]
+    cache_size = cache_size or CONTENT_CONFIG["cache_size"]
+    if is_stale(path):
+        try:
+            size = build(path)
+            logger.info("Built content catalog %s (%s bytes)", path, size)
+        except OSError as e:
+            if not os.path.exists(path):
+                raise
+            logger.warning("Could not rebuild content catalog %s, using the existing one: %s", path, e)
+
+    try:
+        return ContentCatalog(path, cache_size)
+    except ValueError:
+        # Written by another version of this module
+        build(path)
+        return ContentCatalog(path, cache_size)
+
+
+_catalog: Optional[ContentCatalog] = None
+
+
+def get_catalog() -> ContentCatalog:
+    """Catalog shared by the whole process, opened on first use"""
+    global _catalog
+    if _catalog is None:
+        _catalog = open_catalog()
+    return _catalog
+
+
+def main() -> int:
+    path = CONTENT_CONFIG["file"]
+    if sys.argv[1:] == ["--list"]:
+        catalog = ContentCatalog(path)
+        print(f"{path}: {os.path.getsize(path)} bytes, {len(catalog.groups())} groups")
+        for group in catalog.groups():
+            size = sum(len(text.encode("utf-8")) for text in catalog.items(group))
+            print(f"  {group:<40} {catalog.count(group):>4} entries {size:>7} bytes")
+        catalog.close()
+        return 0
+
+    size = build(path)
+    print(f"Built {path}: {size} bytes")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,28 @@
+"""
+Fake Telegram - Bot and handler context stand-ins for playing games offline
+
+The benchmarks, the simulator, the load test, the handoff measurement and
+the failover check of the Redis stand-in drive a GameManager without a
+Telegram connection; these take the place of the bot it sends through.
+"""
+
+from typing import List, Optional, Tuple
+
+
+class FakeBot:
+    """Bot stand-in that accepts every message; keeps them in ``sent`` if asked to"""
+
+    def __init__(self, record: bool = False):
+        self.record = record
+        self.sent: List[Tuple[int, str]] = []  # (chat_id, text) of each message, when recording
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if self.record:
+            self.sent.append((chat_id, text))
+
+
+class FakeContext:
+    """Handler context stand-in; the game code only uses its bot"""
+
+    def __init__(self, bot: Optional[FakeBot] = None):
+        self.bot = bot if bot is not None else FakeBot()
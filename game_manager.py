@@ -2,82 +2,251 @@
 Game Manager - Handles multiple game instances and their lifecycle
 """
 
+from __future__ import annotations
+
 import asyncio
 import logging
+import os
 import random
-from typing import Dict, Tuple, Optional
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import ContextTypes
+import socket
+import time
+import uuid
+from typing import TYPE_CHECKING, Dict, List, Set, Tuple, Optional
+
+from chat_settings import ChatSettingsStore, next_value
+from game_state import GameKey, GameState
+from config import OUTBOUND_CONFIG, STATE_CONFIG
+from content_catalog import get_catalog
+from logging_setup import game_fields, key_fields
+from rate_limit import create_outbound_limiter
+from reachability import ReachabilityCache, is_gone_topic_error
+from state_backend import StateBackend, create_backend
+from tracing import tracer
 
-from game_state import GameState
-from scenarios import ScenarioManager
-from config import GAME_CONFIG, BOT_MESSAGES, CHARACTER_TAUNTS
+# telegram is imported where it is used so that importing this module stays cheap
+if TYPE_CHECKING:
+    from telegram.ext import ContextTypes
 
 logger = logging.getLogger(__name__)
 
+def vote_data(thread_id: int, target_id: int) -> str:
+    """Callback data of the vote button for a target; games outside topics keep the old format"""
+    return f"vote_{target_id}_{thread_id}" if thread_id else f"vote_{target_id}"
+
+def parse_vote_data(data: str) -> Optional[Tuple[int, int]]:
+    """Extract the forum topic and target user id from vote button callback data"""
+    prefix, _, rest = data.partition("_")
+    target, _, thread = rest.partition("_")
+    if prefix != "vote" or not (target.isascii() and target.isdigit()):
+        return None
+    if not thread:
+        return 0, int(target)
+    if not (thread.isascii() and thread.isdigit()):
+        return None
+    return int(thread), int(target)
+
+def ready_data(thread_id: int) -> str:
+    """Callback data of the "ready to vote" button of a discussion"""
+    return f"ready_{thread_id}" if thread_id else "ready"
+
+def parse_ready_data(data: str) -> Optional[int]:
+    """Extract the forum topic from "ready to vote" button callback data"""
+    prefix, _, thread = data.partition("_")
+    if prefix != "ready":
+        return None
+    if not thread:
+        return 0
+    if not (thread.isascii() and thread.isdigit()):
+        return None
+    return int(thread)
+
 class GameManager:
-    """Manages multiple game instances across different chats"""
+    """Manages multiple game instances across different chats and forum topics"""
+    
+    def __init__(self, backend: Optional[StateBackend] = None, lease_ttl: Optional[float] = None):
+        self.backend = backend or create_backend()
+        self.games: Dict[GameKey, GameState] = {}  # Local view of games this instance has loaded
+        self.leases: Set[GameKey] = set()  # Games whose timers this instance drives
+        self.instance_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.lease_ttl = lease_ttl or STATE_CONFIG["lease_ttl"]
+        self.poll_interval = STATE_CONFIG["poll_interval"]
+        self._lease_tasks: List[asyncio.Task] = []  # Lease renewal and adoption of orphaned games
+        self.draining = False  # Set while handing games over to a new process
+        self.taunt_tasks: Dict[GameKey, asyncio.Task] = {}  # Track taunt tasks for each game
+        self.timer_tasks: Dict[GameKey, asyncio.Task] = {}  # Track the pending phase timer for each game
+        self.closing: Dict[GameKey, asyncio.Task] = {}  # Task changing the phase of a game right now
+        self.reachability = ReachabilityCache()
+        self.outbound = create_outbound_limiter()  # Shared by all topics of a chat
+        self.chat_settings = ChatSettingsStore()
+    
+    async def start(self, context: ContextTypes.DEFAULT_TYPE):
+        """Start background work; with a shared backend, keep leases and adopt orphaned games"""
+        loaded = self.chat_settings.load()
+        logger.info("Loaded settings of %s chats", loaded)
+        self.chat_settings.start()
+        
+        if self.backend.shared and not self._lease_tasks:
+            self._lease_tasks = [
+                asyncio.create_task(self._lease_keeper()),
+                asyncio.create_task(self._orphan_sweeper(context)),
+            ]
     
-    def __init__(self):
-        self.games: Dict[int, GameState] = {}
-        self.scenario_manager = ScenarioManager()
-        self.taunt_tasks: Dict[int, asyncio.Task] = {}  # Track taunt tasks for each game
+    async def shutdown(self):
+        """Stop driving games and hand their leases back to other instances"""
+        for task in self._lease_tasks:
+            task.cancel()
+        self._lease_tasks = []
+        for key in list(self.leases):
+            self._drop_game(key)
+            await self.backend.release_lease(key, self.instance_id)
+        await self.backend.close()
+        self.chat_settings.close()
     
-    async def start_game(self, chat_id: int, creator_id: int, creator_username: str, context: ContextTypes.DEFAULT_TYPE) -> Tuple[bool, str]:
-        """Start a new game in the specified chat"""
-        if chat_id in self.games:
-            game = self.games[chat_id]
-            if game.phase != "ended":
-                return False, "❌ Игра уже идет в этом чате! Используйте /status для информации."
+    async def drain(self) -> List[dict]:
+        """Stop accepting games and driving timers; return live games for a handoff"""
+        self.draining = True
+        self.chat_settings.close()
+        exported = []
+        for key in list(self.leases):
+            game = self.games.get(key)
+            if game is not None and game.phase != "ended":
+                exported.append(game.to_dict())
+            self._drop_game(key)
+            await self.backend.release_lease(key, self.instance_id)
+        return exported
+    
+    async def import_games(self, games: List[dict], context: ContextTypes.DEFAULT_TYPE) -> int:
+        """Take over games handed over by a draining process and resume their timers"""
+        # The draining process wrote its settings before handing over
+        self.chat_settings.load()
+        resumed = 0
+        for data in games:
+            try:
+                game = GameState.from_dict(data)
+            except (KeyError, TypeError, ValueError) as e:
+                # One unreadable game must not cost the others
+                logger.error("Skipping a handed-over game that could not be read: %r", e)
+                continue
+            if not await self.backend.acquire_lease(game.key, self.instance_id, self.lease_ttl):
+                continue
+            self.leases.add(game.key)
+            await self.backend.save_game(game)
+            self.resume_game(game, context)
+            resumed += 1
+        return resumed
+    
+    async def load_game(self, key: GameKey) -> Optional[GameState]:
+        """Fetch the current state of a game from the backend"""
+        game = await self.backend.load_game(key)
+        self._remember(key, game)
+        return game
+    
+    def _local_view(self, key: GameKey) -> Optional[GameState]:
+        """The game as known locally, if that is current: always with a private backend, else only while driving it"""
+        if self.backend.shared and key not in self.leases:
+            return None
+        return self.games.get(key)
+    
+    def _remember(self, key: GameKey, game: Optional[GameState]):
+        """Update the local view of a game"""
+        if game is None:
+            self.games.pop(key, None)
+        else:
+            self.games[key] = game
+    
+    async def start_game(self, key: GameKey, creator_id: int, creator_username: str, context: ContextTypes.DEFAULT_TYPE) -> Tuple[bool, str]:
+        """Start a new game in the specified chat or forum topic"""
+        if self.draining:
+            return False, "🔧 Бот обновляется. Начните игру через минуту."
+        
+        game = await self.load_game(key)
+        if game is not None and game.phase != "ended":
+            return False, "❌ Игра уже идет в этом чате! Используйте /status для информации."
+        
+        # Another instance may be creating a game in this chat right now
+        if not await self.backend.acquire_lease(key, self.instance_id, self.lease_ttl):
+            return False, "❌ Игра уже идет в этом чате! Используйте /status для информации."
+        self.leases.add(key)
+        
+        # The bot is receiving updates from this chat, so it is not dead
+        self.reachability.mark_chat_alive(key.chat_id)
         
         # Create new game instance
-        self.games[chat_id] = GameState(chat_id, creator_id, creator_username)
+        settings = self.chat_settings.resolve(key.chat_id)
+        game = GameState(key.chat_id, creator_id, creator_username, settings, thread_id=key.thread_id)
+        game.phase_deadline = time.time() + game.settings.registration_time
+        self.games[key] = game
+        await self.backend.save_game(game)
+        tracer.start_game(key)
+        tracer.start_phase(key, "registration", game.round_number)
         
         # Schedule registration timer
-        asyncio.create_task(self._registration_timer(chat_id, context))
+        self._schedule_timer(key, self._registration_timer(key, context))
         
-        return True, BOT_MESSAGES["game_started"].format(
-            time_left="2:00",
+        minutes, seconds = divmod(int(game.settings.registration_time), 60)
+        return True, get_catalog().message("game_started").format(
+            time_left=f"{minutes}:{seconds:02d}",
             player_count=1
         )
     
-    def join_game(self, chat_id: int, user_id: int, username: str) -> Tuple[bool, str]:
+    async def join_game(self, key: GameKey, user_id: int, username: str) -> Tuple[bool, str]:
         """Add a player to the game"""
-        if chat_id not in self.games:
+        # Reject obvious failures from the local view without touching the backend
+        game = self._local_view(key)
+        if game is not None:
+            error = self._join_error(game, user_id)
+            if error:
+                return False, error
+        
+        added, game = await self.backend.add_player(key, user_id, username)
+        self._remember(key, game)
+        if game is None:
             return False, "❌ Нет активной игры в этом чате. Создайте игру командой /startgame"
         
-        game = self.games[chat_id]
+        if not added:
+            return False, self._join_error(game, user_id) or "❌ Ошибка при добавлении игрока"
         
+        # Another instance may have closed registration or filled the game meanwhile
+        if game.phase != "registration" or len(game.players) > game.settings.max_players:
+            await self.backend.remove_player(key, user_id)
+            game.players.pop(user_id, None)
+            return False, self._join_error(game, user_id) or "❌ Ошибка при добавлении игрока"
+        
+        message = f"✅ @{username} присоединился к игре! Игроков: {len(game.players)}"
+        if self.reachability.is_user_unreachable(user_id):
+            message += (
+                f"\n⚠️ @{username}, я не могу написать тебе в личку. "
+                "Открой чат с ботом и нажми /start, иначе не узнаешь свою роль."
+            )
+        return True, message
+    
+    def _join_error(self, game: GameState, user_id: int) -> Optional[str]:
+        """Reason a user can't join the game, if any"""
         if game.phase != "registration":
-            return False, "❌ Регистрация уже закончилась!"
+            return "❌ Регистрация уже закончилась!"
         
         if user_id in game.players:
-            return False, "❌ Вы уже в игре!"
+            return "❌ Вы уже в игре!"
         
-        if len(game.players) >= GAME_CONFIG["max_players"]:
-            return False, f"❌ Максимум {GAME_CONFIG['max_players']} игроков!"
+        if len(game.players) >= game.settings.max_players:
+            return f"❌ Максимум {game.settings.max_players} игроков!"
         
-        success = game.add_player(user_id, username)
-        if success:
-            return True, f"✅ @{username} присоединился к игре! Игроков: {len(game.players)}"
-        else:
-            return False, "❌ Ошибка при добавлении игрока"
+        return None
     
-    def get_game_status(self, chat_id: int) -> str:
+    async def get_game_status(self, key: GameKey) -> str:
         """Get current game status"""
-        if chat_id not in self.games:
+        game = await self.load_game(key)
+        if game is None:
             return "❌ Нет активной игры в этом чате"
         
-        game = self.games[chat_id]
-        
         if game.phase == "registration":
-            return f"📝 Регистрация игроков ({len(game.players)}/{GAME_CONFIG['max_players']})\n" + \
+            return f"📝 Регистрация игроков ({len(game.players)}/{game.settings.max_players})\n" + \
                    f"Игроки: {', '.join([f'@{p.username}' for p in game.players.values()])}"
         
         elif game.phase == "discussion":
             return f"💬 Фаза обсуждения\n" + \
                    f"Игроков: {len([p for p in game.players.values() if p.alive])}\n" + \
-                   f"Сценарий активен"
+                   f"Готовы голосовать: {game.ready_count()}/{game.ready_needed()}"
         
         elif game.phase == "voting":
             votes_cast = len(game.votes)
@@ -91,38 +260,116 @@ class GameManager:
         else:
             return "❓ Неизвестное состояние игры"
     
-    def get_game(self, chat_id: int) -> Optional[GameState]:
+    async def change_setting(self, key: GameKey, user_id: int, name: str, context: ContextTypes.DEFAULT_TYPE) -> Tuple[bool, str]:
+        """Switch a chat setting to its next value; applies to the game in registration and later games"""
+        game = await self.load_game(key)
+        if game is None:
+            return False, "❌ Нет активной игры для настройки"
+        
+        if game.creator_id != user_id:
+            return False, "❌ Только создатель игры может менять настройки"
+        
+        if game.phase != "registration" or key in self.closing:
+            return False, "❌ Настройки можно менять только во время регистрации"
+        
+        game.settings = self.chat_settings.update(key.chat_id, name, next_value(game.settings, name, len(game.players)))
+        
+        # A new registration time restarts the countdown of the game this instance drives
+        if name == "registration_time" and key in self.leases:
+            game.phase_deadline = time.time() + game.settings.registration_time
+            self._schedule_timer(key, self._registration_timer(key, context))
+        await self.backend.save_game(game)
+        return True, "✅ Настройка сохранена"
+    
+    def get_game(self, key: GameKey) -> Optional[GameState]:
         """Get game instance for chat"""
-        return self.games.get(chat_id)
+        return self.games.get(key)
     
-    async def cast_vote(self, chat_id: int, voter_id: int, target_id: int, context: ContextTypes.DEFAULT_TYPE) -> Tuple[bool, str]:
+    async def cast_vote(self, key: GameKey, voter_id: int, target_id: int, context: ContextTypes.DEFAULT_TYPE) -> Tuple[bool, str]:
         """Cast a vote for elimination"""
-        if chat_id not in self.games:
+        # Reject obvious failures from the local view without touching the backend
+        game = self._local_view(key)
+        if game is not None:
+            error = self._vote_error(game, voter_id, target_id)
+            if error:
+                return False, error
+        
+        # Cast the vote; the backend returns the game as of the write in the same round-trip
+        game = await self.backend.record_vote(key, voter_id, target_id)
+        self._remember(key, game)
+        if game is None:
             return False, "❌ Нет активной игры"
         
-        game = self.games[chat_id]
+        # Votes are final, so voting can close as soon as its outcome is settled
+        if game.votes.get(voter_id, target_id) != target_id:
+            return False, "❌ Вы уже проголосовали"
+        
+        error = self._vote_error(game, voter_id, target_id)
+        if error:
+            await self.backend.retract_vote(key, voter_id)
+            game.votes.pop(voter_id, None)
+            return False, error
+        
+        target_username = game.players[target_id].username
+        return True, f"✅ Вы проголосовали против @{target_username}"
+    
+    async def mark_ready(self, key: GameKey, user_id: int) -> Tuple[bool, str]:
+        """Mark a player ready to end the discussion and vote"""
+        game = await self.backend.mark_ready(key, user_id)
+        self._remember(key, game)
+        if game is None:
+            return False, "❌ Нет активной игры"
+        
+        if game.phase != "discussion":
+            return False, "❌ Обсуждение уже закончилось"
+        
+        player = game.players.get(user_id)
+        if player is None or not player.alive:
+            return False, "❌ Вы не участвуете в обсуждении"
         
+        return True, f"✅ Готов к голосованию ({game.ready_count()}/{game.ready_needed()})"
+    
+    async def close_discussion(self, key: GameKey, context: ContextTypes.DEFAULT_TYPE):
+        """Start voting before the discussion deadline once enough players are ready"""
+        with tracer.span("close_discussion", key):
+            # Only the instance driving the game may move it on
+            if key not in self.leases:
+                return
+            game = await self.load_game(key)
+            if game is None or game.phase != "discussion" or game.ready_count() < game.ready_needed():
+                return
+            
+            self._cancel_timer(key)
+            await self._start_voting_phase(key, context)
+    
+    def _vote_error(self, game: GameState, voter_id: int, target_id: int) -> Optional[str]:
+        """Reason a vote is invalid, if any"""
         if game.phase != "voting":
-            return False, "❌ Сейчас не время для голосования"
+            return "❌ Сейчас не время для голосования"
         
         if voter_id not in game.players or not game.players[voter_id].alive:
-            return False, "❌ Вы не можете голосовать"
+            return "❌ Вы не можете голосовать"
         
         if target_id not in game.players or not game.players[target_id].alive:
-            return False, "❌ Неверная цель для голосования"
-        
-        # Cast the vote
-        game.votes[voter_id] = target_id
-        target_username = game.players[target_id].username
+            return "❌ Неверная цель для голосования"
         
-        return True, f"✅ Вы проголосовали против @{target_username}"
+        return None
     
-    async def process_votes(self, chat_id: int, context: ContextTypes.DEFAULT_TYPE):
-        """Process voting results and determine elimination"""
-        if chat_id not in self.games:
+    async def process_votes(self, key: GameKey, context: ContextTypes.DEFAULT_TYPE, early: bool = False):
+        """Process voting results and determine elimination; early when closed because the outcome is settled"""
+        with tracer.span("process_votes", key):
+            # Only the instance driving the game may close its voting
+            if key not in self.leases:
+                return
+            await self._close_voting(key, context, early)
+    
+    async def _close_voting(self, key: GameKey, context: ContextTypes.DEFAULT_TYPE, early: bool):
+        game = await self.load_game(key)
+        if game is None or game.phase != "voting":
             return
         
-        game = self.games[chat_id]
+        # Votes arriving from now on must not close this voting again
+        self._cancel_timer(key)
         
         # Count votes
         vote_counts = {}
@@ -131,26 +378,27 @@ class GameManager:
         
         # Find player with most votes
         if not vote_counts:
-            await context.bot.send_message(
-                chat_id,
-                "❌ Никто не проголосовал! Игра завершается."
-            )
-            game.end_game()
+            await self.finish_game(game)
+            await self._send_to_chat(key, context, "❌ Никто не проголосовал! Игра завершается.")
             return
         
         eliminated_id = max(vote_counts.keys(), key=lambda x: vote_counts[x])
         eliminated_player = game.players[eliminated_id]
         
+        result_message = ""
+        if early and not game.all_votes_cast():
+            result_message = "⏩ Голосование закрыто досрочно: оставшиеся голоса уже ничего не изменят.\n\n"
+        
         # Eliminate player
         eliminated_player.alive = False
+        next_round = False
         
         # Check if eliminated player was the rat
-        result_message = f"🔪 Большинство решило — закопать @{eliminated_player.username}.\n\n"
+        result_message += f"🔪 Большинство решило — закопать @{eliminated_player.username}.\n\n"
         
         if eliminated_player.is_rat:
             result_message += "🎯 Крыса была угадана! Молодцы, торчки победили!"
-            game.end_game()
-            self.stop_taunts(chat_id)
+            await self.finish_game(game)
         else:
             result_message += "🐀 Это была не крыса... Крыса среди нас.\n"
             
@@ -158,180 +406,460 @@ class GameManager:
             alive_players = [p for p in game.players.values() if p.alive]
             if len(alive_players) <= 2:  # Only rat and one other player
                 result_message += "\n🏆 Крыса победила! Слишком мало игроков осталось."
-                game.end_game()
-                self.stop_taunts(chat_id)
+                await self.finish_game(game)
             else:
                 result_message += f"\nОсталось игроков: {len(alive_players)}"
-                # Start new round
-                asyncio.create_task(self._start_discussion_phase(chat_id, context))
+                next_round = True
+                game.round_number += 1
+                # Leave the voting phase now; the result may wait behind other sends to the chat.
+                # A process taking the game over meanwhile resumes this discussion at its deadline
+                game.start_discussion()
+                game.phase_deadline = time.time() + game.settings.discussion_time
+                await self.backend.save_game(game)
+        
+        if not await self._send_to_chat(key, context, result_message):
+            return
         
-        await context.bot.send_message(chat_id, result_message)
+        if next_round:
+            # Start new round
+            self._begin_transition(key, self._start_discussion_phase(key, context), context)
+    
+    async def finish_game(self, game: GameState):
+        """End a game and stop driving it"""
+        game.end_game()
+        tracer.end_game(game.key)
+        self.stop_taunts(game.key)
+        self._cancel_timer(game.key)
+        await self.backend.save_game(game)
+        self.leases.discard(game.key)
+        await self.backend.release_lease(game.key, self.instance_id)
+    
+    def _drives(self, key: GameKey, game: Optional[GameState], phase: str) -> bool:
+        """Check that this instance still drives the game and it is in the given phase"""
+        return key in self.leases and game is not None and game.phase == phase
+    
+    @staticmethod
+    def _time_left(game: Optional[GameState]) -> float:
+        """Seconds until the current phase deadline"""
+        if game is None or game.phase_deadline is None:
+            return 0.0
+        return max(0.0, game.phase_deadline - time.time())
     
-    async def _registration_timer(self, chat_id: int, context: ContextTypes.DEFAULT_TYPE):
+    async def _registration_timer(self, key: GameKey, context: ContextTypes.DEFAULT_TYPE):
         """Handle registration phase timer"""
-        registration_time = GAME_CONFIG["registration_time"]
-        
-        # Send periodic updates
+        # Send periodic updates, skipping the ones already past
         for remaining in [90, 60, 30]:
-            await asyncio.sleep(registration_time - remaining)
-            if chat_id not in self.games or self.games[chat_id].phase != "registration":
-                return
+            delay = self._time_left(self.games.get(key)) - remaining
+            if delay < 0:
+                continue
+            await asyncio.sleep(delay)
             
-            game = self.games[chat_id]
-            minutes = remaining // 60
-            seconds = remaining % 60
-            time_str = f"{minutes}:{seconds:02d}" if minutes > 0 else f"{seconds}"
-            
-            await context.bot.send_message(
-                chat_id,
-                f"⏰ Регистрация заканчивается через {time_str}! Игроков: {len(game.players)}"
-            )
+            with tracer.span("timer.registration_reminder", key, remaining=remaining):
+                game = await self.load_game(key)
+                if not self._drives(key, game, "registration"):
+                    return
+                
+                minutes = remaining // 60
+                seconds = remaining % 60
+                time_str = f"{minutes}:{seconds:02d}" if minutes > 0 else f"{seconds}"
+                
+                message = f"⏰ Регистрация заканчивается через {time_str}! Игроков: {len(game.players)}"
+                unreachable = [
+                    f"@{p.username}" for p in game.players.values()
+                    if self.reachability.is_user_unreachable(p.user_id)
+                ]
+                if unreachable:
+                    message += (
+                        f"\n⚠️ Не смогут получить роль в личке: {', '.join(unreachable)}. "
+                        "Откройте чат с ботом и нажмите /start."
+                    )
+                
+                if not await self._send_to_chat(key, context, message, optional=True):
+                    return
         
         # Wait for remaining time
-        await asyncio.sleep(30)
+        await asyncio.sleep(self._time_left(self.games.get(key)))
         
-        if chat_id not in self.games or self.games[chat_id].phase != "registration":
-            return
-        
-        game = self.games[chat_id]
-        
-        if len(game.players) < GAME_CONFIG["min_players"]:
-            await context.bot.send_message(
-                chat_id,
-                f"❌ Недостаточно игроков для начала игры! Нужно минимум {GAME_CONFIG['min_players']}"
-            )
-            del self.games[chat_id]
-            return
-        
-        # Start the game
-        await self._start_game_phase(chat_id, context)
+        with tracer.span("timer.registration", key):
+            game = await self.load_game(key)
+            if not self._drives(key, game, "registration"):
+                return
+            
+            if len(game.players) < game.settings.min_players:
+                del self.games[key]
+                self.leases.discard(key)
+                self._cancel_timer(key)
+                tracer.end_game(key, outcome="not_enough_players")
+                await self.backend.delete_game(key)
+                await self._send_to_chat(
+                    key,
+                    context,
+                    f"❌ Недостаточно игроков для начала игры! Нужно минимум {game.settings.min_players}"
+                )
+                return
+            
+            # Start the game
+            await self._transition(key, self._start_game_phase(key, context), context)
     
-    async def _start_game_phase(self, chat_id: int, context: ContextTypes.DEFAULT_TYPE):
+    async def _start_game_phase(self, key: GameKey, context: ContextTypes.DEFAULT_TYPE):
         """Start the main game phase"""
-        game = self.games[chat_id]
+        game = await self.load_game(key)
+        if not self._drives(key, game, "registration"):
+            return
         
-        # Assign roles
+        # Assign roles and close registration before the slow role messages go out
         game.assign_roles()
+        game.start_discussion()
+        game.phase_deadline = time.time() + game.settings.discussion_time
+        await self.backend.save_game(game)
         
         # Notify players of their roles
         for player in game.players.values():
-            try:
-                if player.is_rat:
-                    await context.bot.send_message(
-                        player.user_id,
-                        "🤫 Ты крыса. Будь осторожен и не попадись!"
-                    )
-                else:
-                    await context.bot.send_message(
-                        player.user_id,
-                        f"👤 Твоя роль: {player.role}\nТы не крыса. Найди настоящую крысу!"
-                    )
-            except Exception as e:
-                logger.error(f"Could not send role message to user {player.user_id}: {e}")
+            if player.is_rat:
+                text = "🤫 Ты крыса. Будь осторожен и не попадись!"
+            else:
+                text = f"👤 Твоя роль: {player.role}\nТы не крыса. Найди настоящую крысу!"
+            await self._send_to_user(player.user_id, context, text, game)
         
-        await context.bot.send_message(chat_id, "✅ Игра начинается! Роли выданы.")
+        if not await self._send_to_chat(key, context, "✅ Игра начинается! Роли выданы."):
+            return
         
         # Start discussion phase
-        await self._start_discussion_phase(chat_id, context)
+        await self._start_discussion_phase(key, context)
         
         # Start character taunts if enabled
-        if GAME_CONFIG["enable_taunts"]:
-            self.taunt_tasks[chat_id] = asyncio.create_task(self._taunt_loop(chat_id, context))
+        if game.settings.enable_taunts and key in self.games:
+            self.taunt_tasks[key] = asyncio.create_task(self._taunt_loop(key, context))
     
-    async def _start_discussion_phase(self, chat_id: int, context: ContextTypes.DEFAULT_TYPE):
+    async def _start_discussion_phase(self, key: GameKey, context: ContextTypes.DEFAULT_TYPE):
         """Start discussion phase with scenario"""
-        game = self.games[chat_id]
+        game = self.games.get(key)
+        if game is None or key not in self.leases:
+            return
         game.start_discussion()
+        game.phase_deadline = time.time() + game.settings.discussion_time
+        tracer.start_phase(key, "discussion", game.round_number)
+        await self.backend.save_game(game)
         
         # Get random scenario
-        scenario = self.scenario_manager.get_random_scenario()
+        scenario = get_catalog().choice("scenarios")
         player_names = [p.role for p in game.players.values() if p.alive]
         scenario_text = scenario.format(player_names)
         
-        message = f"🎭 {scenario_text}\n\n💬 Обсуждение началось! У вас 2 минуты."
-        await context.bot.send_message(chat_id, message)
+        message = (
+            f"🎭 {scenario_text}\n\n💬 Обсуждение началось! У вас 2 минуты.\n"
+            "Нажмите «Готов», когда будете готовы голосовать: голосование начнётся, "
+            f"как только готовы {game.ready_needed()} из {len(player_names)}."
+        )
+        from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+        reply_markup = InlineKeyboardMarkup([[
+            InlineKeyboardButton("✅ Готов", callback_data=ready_data(key.thread_id))
+        ]])
+        if not await self._send_to_chat(key, context, message, reply_markup=reply_markup):
+            return
+        await self._restart_late_deadline(game, game.settings.discussion_time)
         
         # Start discussion timer
-        asyncio.create_task(self._discussion_timer(chat_id, context))
+        self._schedule_timer(key, self._discussion_timer(key, context))
     
-    async def _discussion_timer(self, chat_id: int, context: ContextTypes.DEFAULT_TYPE):
+    async def _wait_for_deadline(self, key: GameKey, phase: str, settled) -> bool:
+        """Sleep until the phase deadline; True if cut short because settled(game) holds.
+        
+        Ready presses and votes taken by another instance reach this one only
+        through a shared backend, so the game is polled meanwhile. Without one,
+        the handlers close the phase early themselves.
+        """
+        if not self.backend.shared:
+            await asyncio.sleep(self._time_left(self.games.get(key)))
+            return False
+        
+        while True:
+            left = self._time_left(self.games.get(key))
+            if left <= 0:
+                return False
+            await asyncio.sleep(min(left, self.poll_interval))
+            game = await self.load_game(key)
+            if game is not None and game.phase == phase and settled(game):
+                return True
+    
+    async def _discussion_timer(self, key: GameKey, context: ContextTypes.DEFAULT_TYPE):
         """Handle discussion phase timer"""
-        await asyncio.sleep(GAME_CONFIG["discussion_time"])
+        await self._wait_for_deadline(key, "discussion", lambda game: game.ready_count() >= game.ready_needed())
         
-        if chat_id not in self.games or self.games[chat_id].phase != "discussion":
-            return
-        
-        # Start voting phase
-        await self._start_voting_phase(chat_id, context)
+        with tracer.span("timer.discussion", key):
+            game = await self.load_game(key)
+            if not self._drives(key, game, "discussion"):
+                return
+            
+            # Start voting phase
+            await self._transition(key, self._start_voting_phase(key, context), context)
     
-    async def _start_voting_phase(self, chat_id: int, context: ContextTypes.DEFAULT_TYPE):
+    async def _start_voting_phase(self, key: GameKey, context: ContextTypes.DEFAULT_TYPE):
         """Start voting phase"""
-        game = self.games[chat_id]
+        game = self.games.get(key)
+        if game is None or key not in self.leases:
+            return
         game.start_voting()
+        game.phase_deadline = time.time() + game.settings.voting_time
+        tracer.start_phase(key, "voting", game.round_number)
+        await self.backend.save_game(game)
         
         # Create voting keyboard
+        from telegram import InlineKeyboardButton, InlineKeyboardMarkup
         alive_players = [p for p in game.players.values() if p.alive]
         keyboard = []
         
         for player in alive_players:
             keyboard.append([InlineKeyboardButton(
                 f"🗳️ @{player.username}",
-                callback_data=f"vote_{player.user_id}"
+                callback_data=vote_data(key.thread_id, player.user_id)
             )])
         
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        await context.bot.send_message(
-            chat_id,
+        if not await self._send_to_chat(
+            key,
+            context,
             "🗳️ Голосование началось! Кто по-твоему крыса? У вас 2 минуты.",
             reply_markup=reply_markup
-        )
+        ):
+            return
+        await self._restart_late_deadline(game, game.settings.voting_time)
         
         # Start voting timer
-        asyncio.create_task(self._voting_timer(chat_id, context))
+        self._schedule_timer(key, self._voting_timer(key, context))
     
-    async def _voting_timer(self, chat_id: int, context: ContextTypes.DEFAULT_TYPE):
+    async def _restart_late_deadline(self, game: GameState, duration: float):
+        """Give a phase its full length when its announcement waited behind other sends to the chat"""
+        deadline = time.time() + duration
+        if game.phase_deadline is not None and deadline - game.phase_deadline > duration / 20:
+            game.phase_deadline = deadline
+            await self.backend.save_game(game)
+    
+    async def _voting_timer(self, key: GameKey, context: ContextTypes.DEFAULT_TYPE):
         """Handle voting phase timer"""
-        await asyncio.sleep(GAME_CONFIG["voting_time"])
+        early = await self._wait_for_deadline(key, "voting", GameState.voting_decided)
         
-        if chat_id not in self.games or self.games[chat_id].phase != "voting":
-            return
-        
-        # Process votes even if not everyone voted
-        await self.process_votes(chat_id, context)
+        with tracer.span("timer.voting", key):
+            game = await self.load_game(key)
+            if not self._drives(key, game, "voting"):
+                return
+            
+            # Process votes even if not everyone voted
+            await self._transition(key, self.process_votes(key, context, early), context)
     
-    async def _taunt_loop(self, chat_id: int, context: ContextTypes.DEFAULT_TYPE):
+    async def _taunt_loop(self, key: GameKey, context: ContextTypes.DEFAULT_TYPE):
         """Send random character taunts during the game"""
         try:
-            while chat_id in self.games and self.games[chat_id].phase in ["discussion", "voting"]:
-                await asyncio.sleep(GAME_CONFIG["taunt_frequency"])
+            while key in self.games and self.games[key].phase in ["discussion", "voting"]:
+                await asyncio.sleep(self.games[key].settings.taunt_frequency)
                 
-                if chat_id not in self.games or self.games[chat_id].phase not in ["discussion", "voting"]:
+                if key not in self.games or self.games[key].phase not in ["discussion", "voting"]:
                     break
                 
-                game = self.games[chat_id]
+                game = self.games[key]
                 alive_players = [p for p in game.players.values() if p.alive]
                 
                 if alive_players:
                     # Pick random player and their character
                     target_player = random.choice(alive_players)
-                    character_name = target_player.role
+                    taunts = f"taunts/{target_player.role}"
+                    catalog = get_catalog()
                     
-                    if character_name in CHARACTER_TAUNTS:
-                        taunt = random.choice(CHARACTER_TAUNTS[character_name])
+                    if taunts in catalog:
+                        taunt = catalog.choice(taunts)
                         taunt_message = f"🎭 {taunt}"
                         
-                        await context.bot.send_message(chat_id, taunt_message)
+                        if not await self._send_to_chat(key, context, taunt_message, optional=True):
+                            break
                         
         except Exception as e:
-            logger.error(f"Error in taunt loop: {e}")
+            logger.error("Error in taunt loop: %s", e, extra=key_fields(key))
+        finally:
+            # Clean up task reference, unless a new game of the topic has its own already
+            if self.taunt_tasks.get(key) is asyncio.current_task():
+                del self.taunt_tasks[key]
+    
+    def stop_taunts(self, key: GameKey):
+        """Stop character taunts for a game, unless it is the taunt task calling this"""
+        pending = self.taunt_tasks.pop(key, None)
+        if pending is not None and pending is not asyncio.current_task():
+            pending.cancel()
+    
+    def _schedule_timer(self, key: GameKey, coro):
+        """Run a phase timer for a game, replacing any pending one"""
+        pending = self.timer_tasks.get(key)
+        if pending is not None and pending is not asyncio.current_task():
+            pending.cancel()
+        self.timer_tasks[key] = asyncio.create_task(coro)
+    
+    def start_transition(self, key: GameKey, transition, context: ContextTypes.DEFAULT_TYPE) -> bool:
+        """Run a phase change of a driven game in the background, as its timer.
+        
+        A phase change sends to the chat and waits its turn in the chat's
+        outbound queue; an update handler awaiting it would hold up the
+        updates of every chat. Returns False, without running it, when this
+        instance does not drive the game or its phase is already changing.
+        """
+        if key not in self.leases or key in self.closing:
+            transition.close()
+            return False
+        self._begin_transition(key, transition, context)
+        return True
+    
+    def _begin_transition(self, key: GameKey, transition, context: ContextTypes.DEFAULT_TYPE):
+        self._schedule_timer(key, self._transition(key, transition, context))
+        # Marked before the task runs, so no other change is started meanwhile
+        self.closing[key] = self.timer_tasks[key]
+    
+    async def _transition(self, key: GameKey, transition, context: ContextTypes.DEFAULT_TYPE):
+        """Run a phase change from the timer task of a game; no other change starts meanwhile"""
+        task = asyncio.current_task()
+        self.closing[key] = task
+        try:
+            await transition
         finally:
-            # Clean up task reference
-            if chat_id in self.taunt_tasks:
-                del self.taunt_tasks[chat_id]
-    
-    def stop_taunts(self, chat_id: int):
-        """Stop character taunts for a game"""
-        if chat_id in self.taunt_tasks:
-            self.taunt_tasks[chat_id].cancel()
-            del self.taunt_tasks[chat_id]
+            if self.closing.get(key) is task:
+                del self.closing[key]
+            # A change that found the game had moved on leaves it without a timer
+            if self.timer_tasks.get(key) is task:
+                del self.timer_tasks[key]
+                game = self.games.get(key)
+                if key in self.leases and game is not None:
+                    self._start_timer(game, context)
+    
+    def _start_timer(self, game: GameState, context: ContextTypes.DEFAULT_TYPE) -> bool:
+        """Run the timer of the current phase of a game; False if the phase has none"""
+        timers = {
+            "registration": self._registration_timer,
+            "discussion": self._discussion_timer,
+            "voting": self._voting_timer,
+        }
+        if game.phase not in timers:
+            return False
+        self._schedule_timer(game.key, timers[game.phase](game.key, context))
+        return True
+    
+    def _cancel_timer(self, key: GameKey):
+        """Cancel the pending phase timer of a game, unless it is the task calling this"""
+        pending = self.timer_tasks.pop(key, None)
+        if pending is not None and pending is not asyncio.current_task():
+            pending.cancel()
+    
+    def _drop_game(self, key: GameKey):
+        """Forget a game locally and cancel its timers and taunts"""
+        self.games.pop(key, None)
+        self.leases.discard(key)
+        self.stop_taunts(key)
+        tracer.end_game(key)
+        self._cancel_timer(key)
+    
+    async def end_game_now(self, key: GameKey):
+        """Tear down a game, its timers and taunts right away"""
+        self._drop_game(key)
+        await self.backend.delete_game(key)
+    
+    def resume_game(self, game: GameState, context: ContextTypes.DEFAULT_TYPE):
+        """Restart the timers of a game this instance has just taken over"""
+        key = game.key
+        self.games[key] = game
+        if not self._start_timer(game, context):
+            return
+        tracer.start_game(key)
+        tracer.start_phase(key, game.phase, game.round_number, resumed=True)
+        
+        if game.phase != "registration" and game.settings.enable_taunts and key not in self.taunt_tasks:
+            self.taunt_tasks[key] = asyncio.create_task(self._taunt_loop(key, context))
+    
+    async def _lease_keeper(self):
+        """Renew the leases of driven games.
+        
+        Runs on its own schedule, so a long sweep for orphaned games never
+        delays a renewal past the lease TTL.
+        """
+        while True:
+            try:
+                held = set(self.leases)
+                renewed = await self.backend.renew_leases(held, self.instance_id, self.lease_ttl)
+                for key in held - renewed:
+                    logger.warning("Lost the lease of a game to another instance", extra=key_fields(key))
+                    self._drop_game(key)
+            except Exception as e:
+                logger.error("Error renewing leases: %s", e)
+            
+            await asyncio.sleep(self.lease_ttl / 3)
+    
+    async def _orphan_sweeper(self, context: ContextTypes.DEFAULT_TYPE):
+        """Adopt games whose instance died: active games whose lease nobody holds"""
+        while True:
+            try:
+                candidates = [key for key in await self.backend.active_games() if key not in self.leases]
+                for key in await self.backend.unleased(candidates):
+                    if key in self.leases:
+                        continue
+                    if not await self.backend.acquire_lease(key, self.instance_id, self.lease_ttl):
+                        continue
+                    
+                    game = await self.load_game(key)
+                    if game is None or game.phase == "ended":
+                        await self.backend.release_lease(key, self.instance_id)
+                        continue
+                    
+                    self.leases.add(key)
+                    logger.info("Took over an orphaned game", extra=game_fields(game))
+                    self.resume_game(game, context)
+            except Exception as e:
+                logger.error("Error adopting orphaned games: %s", e)
+            
+            await asyncio.sleep(self.lease_ttl / 3)
+    
+    async def _send_to_chat(self, key: GameKey, context: ContextTypes.DEFAULT_TYPE, text: str,
+                            optional: bool = False, **kwargs) -> bool:
+        """Send a message to the topic of a game; tears the game down if the chat or topic is gone.
+        
+        Sends are paced under the chat's rate limit, which all of its topics
+        share. Optional messages are skipped while the chat has a backlog.
+        """
+        if self.reachability.is_chat_dead(key.chat_id):
+            await self.end_game_now(key)
+            return False
+        
+        if optional and self.outbound.backlog(key.chat_id) > OUTBOUND_CONFIG["optional_backlog"]:
+            return True
+        
+        from telegram.error import TelegramError
+        try:
+            with tracer.span("send_message", key, recipient="chat") as span:
+                waited = await self.outbound.wait(key.chat_id)
+                span.set(queued_ms=round(waited * 1000, 1))
+                await context.bot.send_message(key.chat_id, text, message_thread_id=key.thread_id or None, **kwargs)
+        except TelegramError as e:
+            if is_gone_topic_error(e):
+                logger.warning("Forum topic is gone, ending its game: %s", e, extra=key_fields(key))
+            elif self.reachability.record_chat_error(key.chat_id, e):
+                logger.warning("Chat is unreachable, ending its game: %s", e, extra=key_fields(key))
+            else:
+                raise
+            await self.end_game_now(key)
+            return False
+        return True
+    
+    async def announce(self, key: GameKey, context: ContextTypes.DEFAULT_TYPE, text: str) -> bool:
+        """Send a message from outside the game flow to the topic of a game; False if it is gone"""
+        return await self._send_to_chat(key, context, text)
+    
+    async def _send_to_user(self, user_id: int, context: ContextTypes.DEFAULT_TYPE, text: str, game: GameState) -> bool:
+        """Send a private message, skipping users known to be unreachable"""
+        if self.reachability.is_user_unreachable(user_id):
+            return False
+        
+        from telegram.error import TelegramError
+        try:
+            with tracer.span("send_message", game.key, recipient="user", user_id=user_id):
+                await self.outbound.wait(None)
+                await context.bot.send_message(user_id, text)
+        except TelegramError as e:
+            self.reachability.record_user_error(user_id, e)
+            logger.error("Could not send private message to user %s: %s", user_id, e, extra=game_fields(game))
+            return False
+        return True
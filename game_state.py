@@ -2,10 +2,33 @@
 Game State - Represents the state of a single game instance
 """
 
+import math
 import random
-from typing import Dict, List, Optional
+from typing import Dict, List, NamedTuple, Optional, Set
 from dataclasses import dataclass
-from config import ROLES
+from content_catalog import get_catalog
+from chat_settings import GameSettings, default_settings
+
+class GameKey(NamedTuple):
+    """Identifies a game: the chat and the forum topic it runs in (0 outside topics)"""
+    chat_id: int
+    thread_id: int = 0
+    
+    def __str__(self) -> str:
+        # Games outside topics keep the plain chat id used before topics were supported
+        return f"{self.chat_id}:{self.thread_id}" if self.thread_id else str(self.chat_id)
+    
+    @classmethod
+    def parse(cls, text: str) -> "GameKey":
+        """Restore a key from its ``str`` form"""
+        chat_id, _, thread_id = text.partition(":")
+        return cls(int(chat_id), int(thread_id or 0))
+    
+    @classmethod
+    def of_message(cls, message) -> "GameKey":
+        """Key of the game a message belongs to: its chat, and its topic in forum supergroups"""
+        thread_id = message.message_thread_id if getattr(message, "is_topic_message", False) else None
+        return cls(message.chat.id, thread_id or 0)
 
 @dataclass
 class Player:
@@ -15,21 +38,39 @@ class Player:
     role: str = ""
     is_rat: bool = False
     alive: bool = True
+    
+    def to_list(self) -> list:
+        """Serialize the player as a compact list"""
+        return [self.user_id, self.username, self.role, self.is_rat, self.alive]
+    
+    @classmethod
+    def from_list(cls, data: list) -> "Player":
+        """Restore a player from ``to_list`` output"""
+        return cls(*data)
 
 class GameState:
     """Represents the state of a single game"""
     
-    def __init__(self, chat_id: int, creator_id: int, creator_username: str):
+    def __init__(self, chat_id: int, creator_id: int, creator_username: str, settings: Optional[GameSettings] = None,
+                 thread_id: int = 0):
         self.chat_id = chat_id
+        self.thread_id = thread_id  # Forum topic the game runs in, 0 outside topics
         self.creator_id = creator_id
         self.phase = "registration"  # registration, discussion, voting, ended
         self.players: Dict[int, Player] = {}
         self.votes: Dict[int, int] = {}  # voter_id -> target_id
+        self.ready: Set[int] = set()  # Players ready to vote before the discussion ends
         self.round_number = 1
+        self.phase_deadline: Optional[float] = None  # Wall-clock time the current phase ends
+        self.settings = settings or default_settings()
         
         # Add creator as first player
         self.add_player(creator_id, creator_username)
     
+    @property
+    def key(self) -> GameKey:
+        return GameKey(self.chat_id, self.thread_id)
+    
     def add_player(self, user_id: int, username: str) -> bool:
         """Add a player to the game"""
         if user_id in self.players:
@@ -41,7 +82,7 @@ class GameState:
     def assign_roles(self):
         """Randomly assign roles to players, including the rat"""
         player_list = list(self.players.values())
-        available_roles = ROLES.copy()
+        available_roles = get_catalog().items("roles")
         
         # Randomly select one player to be the rat
         rat_player = random.choice(player_list)
@@ -60,6 +101,7 @@ class GameState:
         """Start the discussion phase"""
         self.phase = "discussion"
         self.votes.clear()
+        self.ready.clear()
     
     def start_voting(self):
         """Start the voting phase"""
@@ -74,6 +116,34 @@ class GameState:
         alive_players = [p for p in self.players.values() if p.alive]
         return len(self.votes) >= len(alive_players)
     
+    def voting_decided(self) -> bool:
+        """Check whether the votes still missing can no longer change who is eliminated"""
+        alive = [p.user_id for p in self.players.values() if p.alive]
+        missing = len(alive) - len(self.votes)
+        if missing <= 0:
+            return True
+        
+        vote_counts = {}
+        for target_id in self.votes.values():
+            vote_counts[target_id] = vote_counts.get(target_id, 0) + 1
+        if not vote_counts:
+            return False
+        
+        # Strictly ahead of every other player even if all missing votes go to one of them,
+        # so the order process_votes breaks ties in does not matter
+        leader = max(vote_counts, key=vote_counts.get)
+        runner_up = max((vote_counts.get(user_id, 0) for user_id in alive if user_id != leader), default=0)
+        return vote_counts[leader] > runner_up + missing
+    
+    def ready_needed(self) -> int:
+        """Ready players needed to end the discussion early"""
+        alive = sum(1 for p in self.players.values() if p.alive)
+        return max(1, math.ceil(alive * self.settings.ready_quorum))
+    
+    def ready_count(self) -> int:
+        """Alive players ready to vote"""
+        return sum(1 for user_id in self.ready if user_id in self.players and self.players[user_id].alive)
+    
     def get_alive_players(self) -> List[Player]:
         """Get list of alive players"""
         return [p for p in self.players.values() if p.alive]
@@ -84,3 +154,35 @@ class GameState:
             if player.is_rat:
                 return player
         return None
+    
+    def to_dict(self) -> dict:
+        """Serialize the game to JSON-compatible data"""
+        return {
+            "chat_id": self.chat_id,
+            "thread_id": self.thread_id,
+            "creator_id": self.creator_id,
+            "phase": self.phase,
+            "round": self.round_number,
+            "deadline": self.phase_deadline,
+            "settings": self.settings.to_dict(),
+            "players": [p.to_list() for p in self.players.values()],
+            "votes": [[voter, target] for voter, target in self.votes.items()],
+            "ready": list(self.ready),
+        }
+    
+    @classmethod
+    def from_dict(cls, data: dict) -> "GameState":
+        """Restore a game from ``to_dict`` output"""
+        game = cls.__new__(cls)
+        game.chat_id = data["chat_id"]
+        game.thread_id = data.get("thread_id", 0)
+        game.creator_id = data["creator_id"]
+        game.phase = data["phase"]
+        game.round_number = data["round"]
+        game.phase_deadline = data["deadline"]
+        settings = data.get("settings")  # Missing in games handed over by older versions
+        game.settings = GameSettings.from_dict(settings) if settings else default_settings()
+        game.players = {p[0]: Player.from_list(p) for p in data["players"]}
+        game.votes = {voter: target for voter, target in data["votes"]}
+        game.ready = set(data.get("ready", ()))
+        return game
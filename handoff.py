@@ -0,0 +1,195 @@
+"""
+Handoff - Pass live games from a draining process to its replacement
+
+The new process listens on a Unix socket and signals the old one; the old
+process stops polling, serializes its games with their phase deadlines and
+sends them over the socket. If nobody is listening, the games are written
+to a file that the next process picks up at startup.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import struct
+import sys
+import time
+from typing import List, Optional
+
+from atomic_file import write_atomic
+from config import HANDOFF_CONFIG
+
+logger = logging.getLogger(__name__)
+
+_HEADER = struct.Struct("!Q")
+
+
+def encode_games(games: List[dict]) -> bytes:
+    """Serialize exported games for transfer"""
+    return json.dumps({"version": 1, "sent_at": time.time(), "games": games},
+                      ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def decode_games(payload: bytes) -> List[dict]:
+    """Restore games from ``encode_games`` output"""
+    data = json.loads(payload)
+    if data.get("version") != 1:
+        raise ValueError(f"Unsupported handoff version {data.get('version')}")
+    return data["games"]
+
+
+class HandoffListener:
+    """Unix socket server that receives exactly one handoff payload"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._payload: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(self._handle, self.path)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            (length,) = _HEADER.unpack(await reader.readexactly(_HEADER.size))
+            payload = await reader.readexactly(length)
+            writer.write(b"OK")
+            await writer.drain()
+            if not self._payload.done():
+                self._payload.set_result(payload)
+        except (ConnectionError, asyncio.IncompleteReadError) as e:
+            logger.error("Broken handoff connection: %s", e)
+        finally:
+            writer.close()
+
+    async def wait(self, timeout: float) -> Optional[bytes]:
+        """Wait for the payload; None if it didn't arrive in time"""
+        try:
+            return await asyncio.wait_for(asyncio.shield(self._payload), timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            await self.close()
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+
+async def send_handoff(path: str, payload: bytes, timeout: float = 10) -> bool:
+    """Send a payload to a waiting listener; False if nobody took it"""
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_unix_connection(path), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return False
+
+    try:
+        writer.write(_HEADER.pack(len(payload)) + payload)
+        await writer.drain()
+        return await asyncio.wait_for(reader.readexactly(2), timeout) == b"OK"
+    except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+        return False
+    finally:
+        writer.close()
+
+
+def write_handoff_file(path: str, payload: bytes):
+    """Write a payload for the next process to pick up, atomically"""
+    write_atomic(path, payload)
+
+
+def read_handoff_file(path: str) -> Optional[bytes]:
+    """Take a payload left by a previous process, removing the file"""
+    try:
+        with open(path, "rb") as f:
+            payload = f.read()
+    except FileNotFoundError:
+        return None
+    os.unlink(path)
+    return payload
+
+
+async def hand_over(payload: bytes, config: Optional[dict] = None) -> str:
+    """Deliver a payload over the socket, falling back to the file"""
+    config = config or HANDOFF_CONFIG
+    if await send_handoff(config["socket"], payload):
+        return "socket"
+    write_handoff_file(config["file"], payload)
+    return "file"
+
+
+async def measure_handoff(game_count: int = 10000, players_per_game: int = 6) -> dict:
+    """Time a full handoff of ``game_count`` live games between two managers.
+
+    Both managers live in this process and use a recording bot; the payload
+    goes through a real Unix socket. Returns milliseconds per step.
+    """
+    import random
+    import tempfile
+
+    from fake_telegram import FakeContext
+    from game_manager import GameManager
+    from game_state import GameState
+    from state_backend import InMemoryBackend
+
+    old, new = GameManager(InMemoryBackend()), GameManager(InMemoryBackend())
+    now = time.time()
+    for i in range(game_count):
+        game = GameState(-1000000000000 - i // 4, 1, "creator", thread_id=i % 4)
+        for user_id in range(2, players_per_game + 1):
+            game.add_player(user_id, f"player{user_id}")
+        phase = random.choice(["registration", "discussion", "voting"])
+        if phase != "registration":
+            game.assign_roles()
+            game.start_discussion()
+            if phase == "voting":
+                game.start_voting()
+                game.votes = {1: 2, 3: 2}
+        game.phase_deadline = now + 600
+        old.games[game.key] = game
+        old.leases.add(game.key)
+        await old.backend.save_game(game)
+
+    socket_path = os.path.join(tempfile.mkdtemp(), "handoff.sock")
+    listener = HandoffListener(socket_path)
+    await listener.start()
+    timings = {}
+
+    start = time.perf_counter()
+    payload = encode_games(await old.drain())
+    timings["export_ms"] = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    sent = await send_handoff(socket_path, payload)
+    received = await listener.wait(10)
+    timings["transfer_ms"] = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    await new.import_games(decode_games(received), FakeContext())
+    timings["import_ms"] = (time.perf_counter() - start) * 1000
+
+    timings["total_ms"] = timings["export_ms"] + timings["transfer_ms"] + timings["import_ms"]
+    timings["payload_kb"] = len(payload) / 1024
+    timings["games_resumed"] = len(new.timer_tasks)
+    assert sent and timings["games_resumed"] == game_count
+
+    for task in [*new.timer_tasks.values(), *new.taunt_tasks.values()]:
+        task.cancel()
+    return timings
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    result = asyncio.run(measure_handoff(count))
+    print(f"Handoff of {count} games: export {result['export_ms']:.1f} ms, "
+          f"transfer {result['transfer_ms']:.1f} ms, import {result['import_ms']:.1f} ms, "
+          f"total {result['total_ms']:.1f} ms ({result['payload_kb']:.0f} KiB)")
@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+"""
+Load Test - Hundreds of simultaneous tables in the forum topics of one chat
+
+Every table is a game in its own topic of the same supergroup, so all of
+them share the chat's send limit. Players are simulated: they join during
+registration, press "ready" during the discussion and vote at random once
+the voting keyboard of their topic arrives. The games run with the real
+timers and send limits on a virtual clock that jumps to the next timer
+instead of sleeping, so hours of play take seconds and the reported times
+are exact.
+
+The tables are played twice: once with phases running to their deadline
+unless every vote is in, as before early completion, and once closing
+the discussion on a quorum of "ready" and the voting once its outcome is
+settled. The difference is the games-per-hour capacity early completion
+adds.
+
+Usage:
+    python loadtest.py                           # 300 tables of 6 players
+    python loadtest.py --tables 500 --players 8
+    python loadtest.py --taunts                  # with character taunts
+    python loadtest.py --spread                  # every table in its own chat
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import selectors
+import sys
+import tempfile
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional
+from unittest import mock
+
+from chat_settings import ChatSettingsStore
+from config import GAME_CONFIG, OUTBOUND_CONFIG
+from fake_telegram import FakeBot, FakeContext
+from game_manager import GameManager, parse_ready_data, parse_vote_data
+from game_state import GameKey
+from rate_limit import OutboundLimiter
+from state_backend import InMemoryBackend
+
+CHAT_ID = -1001234567890
+
+# Telegram's documented limit for messages to one group
+GROUP_LIMIT_PER_MINUTE = 20
+
+
+class VirtualClock:
+    """Time source for the game code and the event loop during a load test"""
+
+    def __init__(self):
+        # Starts at zero: near an epoch timestamp, the loop's clock resolution is below float precision
+        self.now = 0.0
+
+    def time(self) -> float:
+        return self.now
+
+
+class _SkippingSelector(selectors.DefaultSelector):
+    """Selector that advances the clock by the time it was asked to wait"""
+
+    def __init__(self, clock: VirtualClock):
+        super().__init__()
+        self.clock = clock
+
+    def select(self, timeout=None):
+        events = super().select(0)
+        if not events and timeout:
+            self.clock.now += timeout
+        return events
+
+
+class VirtualTimeLoop(asyncio.SelectorEventLoop):
+    """Event loop that jumps to the next timer instead of sleeping"""
+
+    def __init__(self, clock: VirtualClock):
+        super().__init__(_SkippingSelector(clock))
+        self.clock = clock
+
+    def time(self) -> float:
+        return self.clock.now
+
+
+class RecordingLimiter(OutboundLimiter):
+    """Outbound limiter that records how long each group send was queued"""
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.waits: List[float] = []
+
+    async def wait(self, chat_id):
+        waited = await super().wait(chat_id)
+        if chat_id is not None:
+            self.waits.append(waited)
+        return waited
+
+
+class LoadTestManager(GameManager):
+    """Game manager that records when each game ends"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.finished: Dict[GameKey, float] = {}
+
+    async def finish_game(self, game):
+        self.finished.setdefault(game.key, time.monotonic())
+        await super().finish_game(game)
+
+
+class LoadBot(FakeBot):
+    """Bot stand-in that checks the per-chat send rate and plays the players"""
+
+    def __init__(self, manager: GameManager, discussion_time: float, voting_time: float, early: bool):
+        super().__init__()
+        self.manager = manager
+        self.discussion_time = discussion_time
+        self.voting_time = voting_time
+        self.early = early
+        self.context = None
+        self.group_messages = 0
+        self.private_messages = 0
+        self.taunts = 0
+        self.max_per_minute = 0
+        self.violations = 0
+        self._recent: Dict[int, Deque[float]] = {}
+        self.players: List[asyncio.Task] = []
+        self.handler_times: List[float] = []  # How long each press kept its update handler busy
+
+    async def send_message(self, chat_id, text, message_thread_id=None, reply_markup=None, **kwargs):
+        if chat_id > 0:
+            self.private_messages += 1
+            return
+
+        now = time.monotonic()
+        recent = self._recent.setdefault(chat_id, deque())
+        recent.append(now)
+        while recent[0] <= now - 60:
+            recent.popleft()
+        self.max_per_minute = max(self.max_per_minute, len(recent))
+        if len(recent) > GROUP_LIMIT_PER_MINUTE:
+            self.violations += 1
+
+        self.group_messages += 1
+        if text.startswith("🎭") and "Обсуждение" not in text:
+            self.taunts += 1
+
+        if reply_markup is None:
+            return
+        key = GameKey(chat_id, message_thread_id or 0)
+        buttons = [row[0].callback_data for row in reply_markup.inline_keyboard]
+        if parse_ready_data(buttons[0]) is not None:
+            game = self.manager.get_game(key)
+            if self.early and game is not None:
+                for player in game.get_alive_players():
+                    self.players.append(asyncio.create_task(self._ready(key, player.user_id)))
+            return
+
+        targets = [target for _, target in map(parse_vote_data, buttons)]
+        for voter in targets:
+            self.players.append(asyncio.create_task(self._vote(key, voter, targets)))
+
+    async def _ready(self, key: GameKey, user_id: int):
+        """Press "ready" like a player done talking, as ready_callback does"""
+        await asyncio.sleep(random.uniform(0, self.discussion_time / 2))
+        started = time.monotonic()
+        success, _ = await self.manager.mark_ready(key, user_id)
+        if success:
+            game = self.manager.get_game(key)
+            if game and game.phase == "discussion" and game.ready_count() >= game.ready_needed():
+                self.manager.start_transition(key, self.manager.close_discussion(key, self.context), self.context)
+        self.handler_times.append(time.monotonic() - started)
+
+    async def _vote(self, key: GameKey, voter: int, targets: List[int]):
+        """Vote like a player tapping a button of the keyboard, as vote_callback does"""
+        await asyncio.sleep(random.uniform(0, self.voting_time / 2))
+        target = random.choice([t for t in targets if t != voter])
+        started = time.monotonic()
+        success, _ = await self.manager.cast_vote(key, voter, target, self.context)
+        if success:
+            game = self.manager.get_game(key)
+            if game and game.phase == "voting" and (game.voting_decided() if self.early else game.all_votes_cast()):
+                closing = self.manager.process_votes(key, self.context, self.early)
+                self.manager.start_transition(key, closing, self.context)
+        self.handler_times.append(time.monotonic() - started)
+
+
+def _percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+async def play(tables: int, players: int, taunts: bool, timeout: float, early: bool = True,
+               spread: bool = False) -> dict:
+    """Play ``tables`` games at once in topics of one chat, or each in its own chat"""
+    defaults = {**GAME_CONFIG, "max_players": max(players, GAME_CONFIG["max_players"]), "enable_taunts": taunts}
+    manager = LoadTestManager(InMemoryBackend())
+    manager.chat_settings = ChatSettingsStore(os.path.join(tempfile.mkdtemp(), "settings.json"), defaults)
+    manager.outbound = limiter = RecordingLimiter(
+        OUTBOUND_CONFIG["chat_rate"], OUTBOUND_CONFIG["chat_burst"],
+        OUTBOUND_CONFIG["global_rate"], OUTBOUND_CONFIG["global_burst"], OUTBOUND_CONFIG["max_entries"],
+    )
+    bot = LoadBot(manager, GAME_CONFIG["discussion_time"], GAME_CONFIG["voting_time"], early)
+    context = bot.context = FakeContext(bot)
+
+    started = time.monotonic()
+    if spread:
+        keys = [GameKey(CHAT_ID - table) for table in range(tables)]
+    else:
+        keys = [GameKey(CHAT_ID, thread_id) for thread_id in range(1, tables + 1)]
+    for table, key in enumerate(keys):
+        first_user = table * 1000 + 1
+        ok, message = await manager.start_game(key, first_user, f"player{first_user}", context)
+        assert ok, message
+        for user_id in range(first_user + 1, first_user + players):
+            ok, message = await manager.join_game(key, user_id, f"player{user_id}")
+            assert ok, message
+
+    while len(manager.finished) < tables and time.monotonic() - started < timeout:
+        await asyncio.sleep(1)
+    elapsed = time.monotonic() - started
+
+    for task in [*manager.timer_tasks.values(), *manager.taunt_tasks.values(), *bot.players]:
+        task.cancel()
+
+    lengths = [finished - started for finished in manager.finished.values()]
+    return {
+        "tables": tables,
+        "finished": len(manager.finished),
+        "elapsed": elapsed,
+        "games_per_hour": len(lengths) / max(lengths) * 3600 if lengths else 0.0,
+        "table_games_per_hour": 3600 / (sum(lengths) / len(lengths)) if lengths else 0.0,
+        "game_p50": _percentile(lengths, 0.5),
+        "game_max": max(lengths, default=0.0),
+        "group_messages": bot.group_messages,
+        "private_messages": bot.private_messages,
+        "taunts": bot.taunts,
+        "queued_p50": _percentile(limiter.waits, 0.5),
+        "queued_p95": _percentile(limiter.waits, 0.95),
+        "queued_max": max(limiter.waits, default=0.0),
+        "handler_p50": _percentile(bot.handler_times, 0.5),
+        "handler_max": max(bot.handler_times, default=0.0),
+        "max_per_minute": bot.max_per_minute,
+        "violations": bot.violations,
+    }
+
+
+def run(tables: int, players: int, taunts: bool = False, timeout: float = 24 * 3600, early: bool = True,
+        spread: bool = False, seed: Optional[int] = None) -> dict:
+    """Run the load test on a virtual clock; times in the result are in game seconds"""
+    random.seed(seed)
+    clock = VirtualClock()
+    with mock.patch("time.time", clock.time), mock.patch("time.monotonic", clock.time), \
+            asyncio.Runner(loop_factory=lambda: VirtualTimeLoop(clock)) as runner:
+        return runner.run(play(tables, players, taunts, timeout, early, spread))
+
+
+def _format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    return f"{minutes // 60}:{minutes % 60:02d}:{seconds:02d}"
+
+
+def _gain(before: float, after: float) -> str:
+    return f"{(after / before - 1) * 100:+.0f}%" if before else "n/a"
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Load test many tables in the topics of one chat")
+    parser.add_argument("--tables", type=int, default=300, help="simultaneous games in one chat")
+    parser.add_argument("--players", type=int, default=6, help="players per table")
+    parser.add_argument("--taunts", action="store_true", help="enable character taunts")
+    parser.add_argument("--timeout", type=float, default=24 * 3600, help="give up after this many real seconds")
+    parser.add_argument("--spread", action="store_true", help="play every table in its own chat")
+    parser.add_argument("--seed", type=int, help="random seed")
+    args = parser.parse_args()
+
+    baseline = run(args.tables, args.players, args.taunts, args.timeout, False, args.spread, args.seed)
+    started = time.perf_counter()
+    result = run(args.tables, args.players, args.taunts, args.timeout, True, args.spread, args.seed)
+    wall = time.perf_counter() - started
+
+    print(f"Tables finished:        {result['finished']}/{result['tables']} in {_format_duration(result['elapsed'])} "
+          f"(simulated in {wall:.1f}s)")
+    print(f"Game length:            p50 {_format_duration(result['game_p50'])}, "
+          f"max {_format_duration(result['game_max'])}")
+    print(f"Group messages:         {result['group_messages']} ({result['taunts']} taunts), "
+          f"private: {result['private_messages']}")
+    print(f"Send queueing:          p50 {result['queued_p50']:.1f}s, p95 {result['queued_p95']:.1f}s, "
+          f"max {result['queued_max']:.1f}s")
+    print(f"Button handlers:        p50 {result['handler_p50']:.1f}s, max {result['handler_max']:.1f}s")
+    print(f"Busiest minute:         {result['max_per_minute']} messages "
+          f"(limit {GROUP_LIMIT_PER_MINUTE}, exceeded {result['violations']} times)")
+    print(f"Games per hour:         {baseline['games_per_hour']:.0f} -> {result['games_per_hour']:.0f} "
+          f"({_gain(baseline['games_per_hour'], result['games_per_hour'])}) with early completion")
+    print(f"Games per table-hour:   {baseline['table_games_per_hour']:.1f} -> {result['table_games_per_hour']:.1f} "
+          f"({_gain(baseline['table_games_per_hour'], result['table_games_per_hour'])}), "
+          f"mean game {_format_duration(3600 / baseline['table_games_per_hour'])} -> "
+          f"{_format_duration(3600 / result['table_games_per_hour'])}")
+    ok = all(r["finished"] == r["tables"] and not r["violations"] for r in (baseline, result))
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,295 @@
+"""
+Logging Setup - Non-blocking structured logging pipeline
+
+Records are pushed onto an in-memory queue by the event loop thread and
+formatted and written by a background listener thread, so slow disk or
+console I/O never blocks a handler.
+"""
+
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from config import LOGGING_CONFIG
+
+CONTEXT_FIELDS = ("chat_id", "thread_id", "phase", "round")
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s%(context)s'
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def game_fields(game) -> Dict[str, object]:
+    """Build structured log fields for a game, for use as ``extra=``"""
+    return {"chat_id": game.chat_id, "thread_id": game.thread_id or None, "phase": game.phase,
+            "round": game.round_number}
+
+
+def key_fields(key) -> Dict[str, object]:
+    """Build structured log fields for a game key (chat and forum topic)"""
+    return {"chat_id": key.chat_id, "thread_id": key.thread_id or None}
+
+
+class ContextFilter(logging.Filter):
+    """Ensure structured context fields exist on every record"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        parts = []
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            setattr(record, field, value)
+            if value is not None:
+                parts.append(f"{field}={value}")
+        record.context = f" [{' '.join(parts)}]" if parts else ""
+        return True
+
+
+class RepeatSampler(logging.Filter):
+    """Sample repetitive warnings and errors.
+
+    Records are grouped by logger, level and message template. Within each
+    window the first ``burst`` records of a group pass, the rest are
+    dropped and counted; the first record of the next window carries the
+    number of suppressed duplicates in ``record.suppressed``.
+    """
+
+    def __init__(self, window: float, burst: int, min_level: int = logging.WARNING):
+        super().__init__()
+        self.window = window
+        self.burst = burst
+        self.min_level = min_level
+        self._groups: Dict[Tuple[str, int, str], list] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < self.min_level:
+            return True
+
+        key = (record.name, record.levelno, str(record.msg))
+        now = time.monotonic()
+        with self._lock:
+            group = self._groups.get(key)
+            if group is None or now - group[0] >= self.window:
+                suppressed = group[2] if group else 0
+                self._groups[key] = [now, 1, 0]
+                if suppressed:
+                    record.suppressed = suppressed
+                if len(self._groups) > 10000:
+                    self._prune(now)
+                return True
+
+            if group[1] < self.burst:
+                group[1] += 1
+                return True
+
+            group[2] += 1
+            return False
+
+    def _prune(self, now: float):
+        """Forget groups whose window has expired"""
+        expired = [k for k, g in self._groups.items() if now - g[0] >= self.window and not g[2]]
+        for key in expired:
+            del self._groups[key]
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler that defers message formatting to the listener thread.
+
+    The stock ``QueueHandler.prepare`` renders the message in the calling
+    thread; here the record is enqueued untouched, so ``%``-style arguments
+    are only formatted by the background writer. Log arguments must
+    therefore be immutable values (ids, strings, exceptions).
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    """Render records as one JSON object per line"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            entry["suppressed"] = suppressed
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    """Console formatter that appends context and suppression counts"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            text += f" (+{suppressed} similar suppressed)"
+        return text
+
+
+def _build_writers(config: dict):
+    """Create the handlers that do the actual I/O"""
+    console = logging.StreamHandler(sys.stderr)
+    console.setFormatter(TextFormatter(TEXT_FORMAT))
+    writers = [console]
+
+    log_file = config.get("file")
+    if log_file:
+        directory = os.path.dirname(log_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        file_handler = logging.handlers.RotatingFileHandler(
+            log_file,
+            maxBytes=config["max_bytes"],
+            backupCount=config["backup_count"],
+            encoding="utf-8",
+        )
+        file_handler.setFormatter(JsonFormatter())
+        writers.append(file_handler)
+
+    for writer in writers:
+        writer.addFilter(ContextFilter())
+    return writers
+
+
+def setup_logging(config: Optional[dict] = None) -> logging.handlers.QueueListener:
+    """Install the queue-based logging pipeline on the root logger"""
+    global _listener
+    config = config or LOGGING_CONFIG
+
+    if _listener is not None:
+        return _listener
+
+    log_queue: queue.Queue = queue.Queue(maxsize=config["queue_size"])
+    queue_handler = LazyQueueHandler(log_queue)
+    queue_handler.addFilter(RepeatSampler(config["sample_window"], config["sample_burst"]))
+
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(config["level"])
+
+    _listener = logging.handlers.QueueListener(
+        log_queue, *_build_writers(config), respect_handler_level=True
+    )
+    _listener.start()
+    return _listener
+
+
+def shutdown_logging():
+    """Flush queued records and stop the background writer"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def measure_handler_latency(iterations: int = 2000, directory: str = "logs") -> Dict[str, Dict[str, float]]:
+    """Compare per-call logging latency of the old and new setups.
+
+    Simulates a DM failure storm: every iteration logs one error with
+    context, the way ``_start_game_phase`` does for each unreachable
+    player. Returns mean and p99 latency in microseconds per setup.
+    """
+    os.makedirs(directory, exist_ok=True)
+    error = RuntimeError("Forbidden: bot can't initiate conversation with a user")
+    results = {}
+
+    def run(logger: logging.Logger, lazy: bool) -> Dict[str, float]:
+        samples = []
+        for i in range(iterations):
+            start = time.perf_counter()
+            if lazy:
+                logger.error("Could not send role message to user %s: %s", i, error,
+                             extra={"chat_id": -100, "phase": "registration", "round": 1})
+            else:
+                logger.error(f"Could not send role message to user {i}: {error}")
+            samples.append((time.perf_counter() - start) * 1e6)
+        samples.sort()
+        return {
+            "mean_us": round(sum(samples) / len(samples), 2),
+            "p99_us": round(samples[int(len(samples) * 0.99) - 1], 2),
+        }
+
+    devnull = open(os.devnull, "w")
+
+    # Old setup: basicConfig-style synchronous console handler plus a plain file
+    old_logger = logging.getLogger("latency.sync")
+    old_logger.propagate = False
+    old_console = logging.StreamHandler(devnull)
+    old_file = logging.FileHandler(os.path.join(directory, "latency_sync.log"), encoding="utf-8")
+    for handler in (old_console, old_file):
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+        old_logger.addHandler(handler)
+    results["sync"] = run(old_logger, lazy=False)
+    for handler in (old_console, old_file):
+        old_logger.removeHandler(handler)
+        handler.close()
+
+    # New setup: queue handler with sampling, writers on a background thread
+    config = dict(LOGGING_CONFIG, file=os.path.join(directory, "latency_queue.log"))
+    new_logger = logging.getLogger("latency.queue")
+    new_logger.propagate = False
+    log_queue: queue.Queue = queue.Queue(maxsize=config["queue_size"])
+    queue_handler = LazyQueueHandler(log_queue)
+    queue_handler.addFilter(RepeatSampler(config["sample_window"], config["sample_burst"]))
+    new_logger.addHandler(queue_handler)
+    writers = _build_writers(config)
+    writers[0].setStream(devnull)
+    listener = logging.handlers.QueueListener(log_queue, *writers)
+    listener.start()
+    results["queue"] = run(new_logger, lazy=True)
+    listener.stop()
+    new_logger.removeHandler(queue_handler)
+    for writer in writers:
+        writer.close()
+
+    # New setup without sampling, to show the cost of the queue alone
+    unsampled_logger = logging.getLogger("latency.queue_unsampled")
+    unsampled_logger.propagate = False
+    log_queue = queue.Queue(maxsize=config["queue_size"])
+    queue_handler = LazyQueueHandler(log_queue)
+    unsampled_logger.addHandler(queue_handler)
+    writers = _build_writers(config)
+    writers[0].setStream(devnull)
+    listener = logging.handlers.QueueListener(log_queue, *writers)
+    listener.start()
+    results["queue_unsampled"] = run(unsampled_logger, lazy=True)
+    listener.stop()
+    unsampled_logger.removeHandler(queue_handler)
+    for writer in writers:
+        writer.close()
+
+    devnull.close()
+    return results
+
+
+if __name__ == "__main__":
+    for name, stats in measure_handler_latency().items():
+        print(f"{name:>16}: mean {stats['mean_us']:8.2f} us, p99 {stats['p99_us']:8.2f} us")
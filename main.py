@@ -4,27 +4,86 @@ Telegram bot for "Who's the Rat?" social deduction game
 Main bot entry point with command handlers
 """
 
+from __future__ import annotations
+
+import time
+_process_started = time.perf_counter()
+
 import os
+import atexit
+import signal
+import asyncio
+import argparse
 import logging
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import ContextTypes
+from typing import TYPE_CHECKING
 
-from game_manager import GameManager
-from config import BOT_MESSAGES, GAME_CONFIG, ADMIN_USERS, CHARACTER_TAUNTS
+from broadcast import Broadcaster, parse_command
+from chat_settings import GameSettings
+from game_manager import GameManager, parse_ready_data, parse_vote_data
+from game_state import GameKey
+from config import ADMIN_USERS, HANDOFF_CONFIG
+from content_catalog import get_catalog
+from handoff import HandoffListener, decode_games, encode_games, hand_over, read_handoff_file
+from logging_setup import key_fields, setup_logging, shutdown_logging
+from rate_limit import create_callback_debouncer, create_flood_limiter, user_chat_key
+from startup import StartupReport, build_requests, warm_up
+from tracing import setup_tracing, shutdown_tracing, traced_handler
+
+# telegram takes most of the import time, so it is imported in main() while
+# the network warm-up runs; handlers only need its types for annotations
+if TYPE_CHECKING:
+    from telegram import Update
+    from telegram.ext import Application, ContextTypes
 
-# Configure logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
 logger = logging.getLogger(__name__)
 
 # Initialize game manager
 game_manager = GameManager()
+broadcaster = Broadcaster(game_manager)
+
+# PID of the process to take games over from (--takeover)
+takeover_pid = None
+
+# Inbound flood control, checked before any handler runs
+flood_limiter = create_flood_limiter()
+callback_debouncer = create_callback_debouncer()
+
+# Replaced in main() when started with --startup-report
+startup_report = StartupReport(_process_started, enabled=False)
+
+async def flood_guard(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Drop floods of commands and button taps before they reach the handlers"""
+    from telegram.ext import ApplicationHandlerStop
+    
+    user = update.effective_user
+    chat = update.effective_chat
+    if user is None or chat is None:
+        return
+    
+    key = user_chat_key(user.id, chat.id)
+    query = update.callback_query
+    if query is not None:
+        message_id = query.message.message_id if query.message else 0
+        if callback_debouncer.is_repeat((key, message_id, query.data)):
+            await query.answer()
+            raise ApplicationHandlerStop
+        if not flood_limiter.allow(key):
+            await query.answer("⏳ Не так быстро!")
+            raise ApplicationHandlerStop
+        return
+    
+    message = update.message
+    if message is None or not message.text or not message.text.startswith("/"):
+        return
+    if not flood_limiter.allow(key):
+        raise ApplicationHandlerStop
 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /start command"""
+    if update.effective_chat.type == "private":
+        # The user opened a private chat, so role messages can reach them now
+        game_manager.reachability.mark_user_reachable(update.effective_user.id)
+    
     await update.message.reply_text(
         "🎮 Добро пожаловать в игру 'Кто Крыса?'\n\n"
         "Команды:\n"
@@ -37,39 +96,39 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def startgame_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /startgame command"""
-    chat_id = update.effective_chat.id
+    key = GameKey.of_message(update.effective_message)
     user_id = update.effective_user.id
     username = update.effective_user.username or f"user_{user_id}"
     
     try:
-        success, message = await game_manager.start_game(chat_id, user_id, username, context)
+        success, message = await game_manager.start_game(key, user_id, username, context)
         await update.message.reply_text(message)
     except Exception as e:
-        logger.error(f"Error starting game: {e}")
+        logger.error("Error starting game: %s", e, extra=key_fields(key))
         await update.message.reply_text("❌ Ошибка при создании игры. Попробуйте позже.")
 
 async def join_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /join command"""
-    chat_id = update.effective_chat.id
+    key = GameKey.of_message(update.effective_message)
     user_id = update.effective_user.id
     username = update.effective_user.username or f"user_{user_id}"
     
     try:
-        success, message = game_manager.join_game(chat_id, user_id, username)
+        success, message = await game_manager.join_game(key, user_id, username)
         await update.message.reply_text(message)
     except Exception as e:
-        logger.error(f"Error joining game: {e}")
+        logger.error("Error joining game: %s", e, extra=key_fields(key))
         await update.message.reply_text("❌ Ошибка при присоединении к игре.")
 
 async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /status command"""
-    chat_id = update.effective_chat.id
+    key = GameKey.of_message(update.effective_message)
     
     try:
-        status_message = game_manager.get_game_status(chat_id)
+        status_message = await game_manager.get_game_status(key)
         await update.message.reply_text(status_message)
     except Exception as e:
-        logger.error(f"Error getting status: {e}")
+        logger.error("Error getting status: %s", e, extra=key_fields(key))
         await update.message.reply_text("❌ Ошибка при получении статуса игры.")
 
 async def roles_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -91,30 +150,58 @@ async def roles_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def vote_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle voting callback queries"""
     query = update.callback_query
-    chat_id = query.message.chat_id
+    key = GameKey.of_message(query.message)
     voter_id = query.from_user.id
     
     try:
-        data = query.data.split('_')
-        if len(data) != 2 or data[0] != 'vote':
+        vote = parse_vote_data(query.data)
+        if vote is None:
             await query.answer("❌ Неверный формат голоса")
             return
-            
-        target_id = int(data[1])
-        success, message = await game_manager.cast_vote(chat_id, voter_id, target_id, context)
+        # The topic comes from the button, the message may be too old to carry it
+        thread_id, target_id = vote
+        key = GameKey(key.chat_id, thread_id)
+        
+        success, message = await game_manager.cast_vote(key, voter_id, target_id, context)
         
         await query.answer(message)
         
-        # Check if voting is complete
+        # Close the voting once the missing votes can no longer change its outcome
         if success:
-            game = game_manager.get_game(chat_id)
-            if game and game.phase == "voting" and game.all_votes_cast():
-                await game_manager.process_votes(chat_id, context)
+            game = game_manager.get_game(key)
+            if game and game.phase == "voting" and game.voting_decided():
+                game_manager.start_transition(key, game_manager.process_votes(key, context, early=True), context)
                 
     except Exception as e:
-        logger.error(f"Error processing vote: {e}")
+        logger.error("Error processing vote: %s", e, extra=key_fields(key))
         await query.answer("❌ Ошибка при голосовании")
 
+async def ready_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle the "ready" button of a discussion"""
+    query = update.callback_query
+    key = GameKey.of_message(query.message)
+    
+    try:
+        thread_id = parse_ready_data(query.data)
+        if thread_id is None:
+            await query.answer("❌ Неверный формат кнопки")
+            return
+        key = GameKey(key.chat_id, thread_id)
+        
+        success, message = await game_manager.mark_ready(key, query.from_user.id)
+        
+        await query.answer(message)
+        
+        # Start voting once enough players are ready
+        if success:
+            game = game_manager.get_game(key)
+            if game and game.phase == "discussion" and game.ready_count() >= game.ready_needed():
+                game_manager.start_transition(key, game_manager.close_discussion(key, context), context)
+                
+    except Exception as e:
+        logger.error("Error processing ready button: %s", e, extra=key_fields(key))
+        await query.answer("❌ Ошибка")
+
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /help command"""
     help_text = (
@@ -123,10 +210,11 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "1. Создайте игру командой /startgame\n"
         "2. Игроки присоединяются командой /join\n"
         "3. Через 2 минуты начинается игра\n"
-        "4. Читайте ситуацию и обсуждайте\n"
-        "5. Голосуйте за подозрительного\n"
+        "4. Читайте ситуацию и обсуждайте, жмите «Готов», когда готовы голосовать\n"
+        "5. Голосуйте за подозрительного, голос менять нельзя\n"
         "6. Выясните, кто крыса!\n\n"
         "🎯 Цель: Обычные игроки должны найти крысу, крыса должна остаться незамеченной\n\n"
+        "💬 В группах с темами в каждой теме может идти своя игра\n\n"
         "⚡ Команды:\n"
         "/startgame - начать игру\n"
         "/join - присоединиться\n"
@@ -139,14 +227,14 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def settings_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /settings command"""
-    chat_id = update.effective_chat.id
+    key = GameKey.of_message(update.effective_message)
     user_id = update.effective_user.id
     
-    if chat_id not in game_manager.games:
+    game = await game_manager.load_game(key)
+    if game is None:
         await update.message.reply_text("❌ Нет активной игры для настройки")
         return
         
-    game = game_manager.games[chat_id]
     if game.creator_id != user_id:
         await update.message.reply_text("❌ Только создатель игры может менять настройки")
         return
@@ -155,32 +243,60 @@ async def settings_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ Настройки можно менять только во время регистрации")
         return
     
-    # Show current settings with inline keyboard
+    await update.message.reply_text(
+        "⚙️ Настройки игры:",
+        reply_markup=settings_keyboard(game.settings)
+    )
+
+# Settings buttons: callback data -> setting it switches
+SETTING_BUTTONS = {
+    "set_reg_time": "registration_time",
+    "set_min_players": "min_players",
+    "set_max_players": "max_players",
+    "toggle_taunts": "enable_taunts",
+}
+
+def settings_keyboard(settings: GameSettings):
+    """Inline keyboard showing the current settings of a game"""
     from telegram import InlineKeyboardButton, InlineKeyboardMarkup
     
     keyboard = [
-        [InlineKeyboardButton(f"⏰ Время регистрации: {GAME_CONFIG['registration_time']}с", callback_data="set_reg_time")],
-        [InlineKeyboardButton(f"👥 Мин. игроков: {GAME_CONFIG['min_players']}", callback_data="set_min_players")],
-        [InlineKeyboardButton(f"👥 Макс. игроков: {GAME_CONFIG['max_players']}", callback_data="set_max_players")],
-        [InlineKeyboardButton(f"🎭 Подколы: {'Вкл' if GAME_CONFIG['enable_taunts'] else 'Выкл'}", callback_data="toggle_taunts")]
+        [InlineKeyboardButton(f"⏰ Время регистрации: {settings.registration_time}с", callback_data="set_reg_time")],
+        [InlineKeyboardButton(f"👥 Мин. игроков: {settings.min_players}", callback_data="set_min_players")],
+        [InlineKeyboardButton(f"👥 Макс. игроков: {settings.max_players}", callback_data="set_max_players")],
+        [InlineKeyboardButton(f"🎭 Подколы: {'Вкл' if settings.enable_taunts else 'Выкл'}", callback_data="toggle_taunts")]
     ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    return InlineKeyboardMarkup(keyboard)
+
+async def settings_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle settings button presses"""
+    query = update.callback_query
+    key = GameKey.of_message(query.message)
+    name = SETTING_BUTTONS.get(query.data)
+    if name is None:
+        await query.answer()
+        return
     
-    await update.message.reply_text(
-        "⚙️ Настройки игры:",
-        reply_markup=reply_markup
-    )
+    try:
+        success, message = await game_manager.change_setting(key, query.from_user.id, name, context)
+        await query.answer(message)
+        if success:
+            game = game_manager.get_game(key)
+            await query.edit_message_reply_markup(settings_keyboard(game.settings))
+    except Exception as e:
+        logger.error("Error changing settings: %s", e, extra=key_fields(key))
+        await query.answer("❌ Ошибка при изменении настроек")
 
 async def close_registration_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /closeregistration command"""
-    chat_id = update.effective_chat.id
+    key = GameKey.of_message(update.effective_message)
     user_id = update.effective_user.id
     
-    if chat_id not in game_manager.games:
+    game = await game_manager.load_game(key)
+    if game is None:
         await update.message.reply_text("❌ Нет активной игры")
         return
         
-    game = game_manager.games[chat_id]
     if game.creator_id != user_id:
         await update.message.reply_text("❌ Только создатель игры может закрыть регистрацию")
         return
@@ -189,12 +305,14 @@ async def close_registration_command(update: Update, context: ContextTypes.DEFAU
         await update.message.reply_text("❌ Регистрация уже закончена")
         return
         
-    if len(game.players) < GAME_CONFIG["min_players"]:
-        await update.message.reply_text(f"❌ Недостаточно игроков! Нужно минимум {GAME_CONFIG['min_players']}")
+    if len(game.players) < game.settings.min_players:
+        await update.message.reply_text(f"❌ Недостаточно игроков! Нужно минимум {game.settings.min_players}")
         return
     
+    if not game_manager.start_transition(key, game_manager._start_game_phase(key, context), context):
+        await update.message.reply_text("❌ Не удалось закрыть регистрацию, попробуйте ещё раз")
+        return
     await update.message.reply_text("✅ Регистрация закрыта досрочно! Игра начинается...")
-    await game_manager._start_game_phase(chat_id, context)
 
 # Admin cheat commands (hidden)
 async def admin_reveal_rat(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -203,12 +321,12 @@ async def admin_reveal_rat(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if user_id not in ADMIN_USERS:
         return
         
-    chat_id = update.effective_chat.id
-    if chat_id not in game_manager.games:
+    key = GameKey.of_message(update.effective_message)
+    game = await game_manager.load_game(key)
+    if game is None:
         await update.message.reply_text("❌ Нет активной игры")
         return
         
-    game = game_manager.games[chat_id]
     rat_player = game.get_rat_player()
     if rat_player:
         await update.message.reply_text(f"🐀 Крыса: @{rat_player.username}")
@@ -221,18 +339,25 @@ async def admin_skip_phase(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if user_id not in ADMIN_USERS:
         return
         
-    chat_id = update.effective_chat.id
-    if chat_id not in game_manager.games:
+    key = GameKey.of_message(update.effective_message)
+    game = await game_manager.load_game(key)
+    if game is None:
         await update.message.reply_text("❌ Нет активной игры")
         return
         
-    game = game_manager.games[chat_id]
     if game.phase == "discussion":
-        await game_manager._start_voting_phase(chat_id, context)
-        await update.message.reply_text("⏭️ Фаза пропущена")
+        transition = game_manager._start_voting_phase(key, context)
+        done = "⏭️ Фаза пропущена"
     elif game.phase == "voting":
-        await game_manager.process_votes(chat_id, context)
-        await update.message.reply_text("⏭️ Голосование завершено")
+        transition = game_manager.process_votes(key, context)
+        done = "⏭️ Голосование завершено"
+    else:
+        return
+    
+    if game_manager.start_transition(key, transition, context):
+        await update.message.reply_text(done)
+    else:
+        await update.message.reply_text("❌ Фаза уже сменяется или игру ведёт другой процесс")
 
 async def admin_end_game(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Admin cheat: force end game"""
@@ -240,43 +365,172 @@ async def admin_end_game(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if user_id not in ADMIN_USERS:
         return
         
-    chat_id = update.effective_chat.id
-    if chat_id not in game_manager.games:
+    key = GameKey.of_message(update.effective_message)
+    game = await game_manager.load_game(key)
+    if game is None:
         await update.message.reply_text("❌ Нет активной игры")
         return
         
-    game = game_manager.games[chat_id]
-    game.end_game()
+    await game_manager.finish_game(game)
     await update.message.reply_text("🛑 Игра принудительно завершена админом")
 
+async def admin_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin: message every chat with a running game; /broadcast [phases] text, /broadcast stop"""
+    user_id = update.effective_user.id
+    if user_id not in ADMIN_USERS:
+        return
+    
+    words = update.message.text.split(None, 1)
+    argument = words[1].strip() if len(words) > 1 else ""
+    usage = "Использование: /broadcast [registration,discussion,voting] текст\n/broadcast stop - остановить"
+    
+    if not argument:
+        broadcast = broadcaster.current or broadcaster.load()
+        await update.message.reply_text(broadcast.progress_text() if broadcast else f"📣 Рассылок не было\n{usage}")
+        return
+    
+    if argument == "stop":
+        broadcast = await broadcaster.stop()
+        await update.message.reply_text("⏹ Рассылка остановлена" if broadcast else "❌ Нет активной рассылки")
+        return
+    
+    if broadcaster.running:
+        await update.message.reply_text("❌ Рассылка уже идет. /broadcast stop - остановить")
+        return
+    
+    phases, text = parse_command(argument)
+    if not text:
+        await update.message.reply_text(f"❌ Нет текста рассылки\n{usage}")
+        return
+    
+    # Progress is reported to this chat as the messages go out
+    broadcaster.start(text, phases, GameKey.of_message(update.effective_message), context)
+
+async def post_init(application: Application):
+    """Resume games handed over by a previous process, then start background work"""
+    setup_tracing()
+    await game_manager.start(application)
+    
+    payload = None
+    if takeover_pid:
+        listener = HandoffListener(HANDOFF_CONFIG["socket"])
+        await listener.start()
+        try:
+            os.kill(takeover_pid, signal.SIGUSR1)
+        except OSError as e:
+            # Gone or not ours: it wrote its games to the handoff file, if anything
+            logger.error("Could not signal process %s to hand over its games: %s", takeover_pid, e)
+            await listener.close()
+        else:
+            payload = await listener.wait(HANDOFF_CONFIG["timeout"])
+    if payload is None:
+        payload = read_handoff_file(HANDOFF_CONFIG["file"])
+    if payload is not None:
+        resumed = await game_manager.import_games(decode_games(payload), application)
+        logger.info("Resumed %s handed-over games", resumed)
+    
+    # Continue a broadcast that a crash, restart or handover interrupted
+    await broadcaster.resume(application)
+    
+    asyncio.get_running_loop().add_signal_handler(
+        signal.SIGUSR1, lambda: asyncio.create_task(drain(application))
+    )
+    startup_report.mark("initialize")
+
+async def drain(application: Application):
+    """Stop polling and hand live games over to the new process (on SIGUSR1)"""
+    logger.info("Drain requested, handing games over")
+    game_manager.draining = True
+    
+    # Finish updates already fetched so no vote or join is lost
+    await application.updater.stop()
+    while not application.update_queue.empty():
+        await asyncio.sleep(0.05)
+    
+    started = time.perf_counter()
+    await broadcaster.close()
+    games = await game_manager.drain()
+    channel = await hand_over(encode_games(games))
+    logger.info("Handed over %s games via %s in %.1f ms", len(games), channel, (time.perf_counter() - started) * 1000)
+    application.stop_running()
+
+# Handlers registered at startup: (command, callback)
+COMMAND_HANDLERS = (
+    ("start", start_command),
+    ("startgame", startgame_command),
+    ("join", join_command),
+    ("status", status_command),
+    ("roles", roles_command),
+    ("help", help_command),
+    ("settings", settings_command),
+    ("closeregistration", close_registration_command),
+    # Admin cheat commands (hidden)
+    ("adminrat", admin_reveal_rat),
+    ("adminskip", admin_skip_phase),
+    ("adminend", admin_end_game),
+    ("broadcast", admin_broadcast),
+)
+
+async def post_shutdown(application: Application):
+    """Release games and write out buffered settings, traces and broadcast status"""
+    await broadcaster.close()
+    await game_manager.shutdown()
+    shutdown_tracing()
+
 def main():
     """Main function to run the bot"""
+    global takeover_pid, startup_report
+    parser = argparse.ArgumentParser(description="Telegram bot for the 'Who's the Rat?' game")
+    parser.add_argument("--takeover", type=int, metavar="PID",
+                        help="take running games over from the bot process with this PID")
+    parser.add_argument("--startup-report", action="store_true",
+                        help="print the time spent in each startup phase up to the first poll")
+    args = parser.parse_args()
+    takeover_pid = args.takeover
+    startup_report = StartupReport(_process_started, enabled=args.startup_report)
+    
+    # Build the SSL context while telegram is being imported
+    warm = warm_up()
+    from telegram import Update
+    from telegram.ext import Application, CallbackQueryHandler, CommandHandler, TypeHandler
+    startup_report.mark("imports")
+    
+    # Configure logging
+    setup_logging()
+    atexit.register(shutdown_logging)
+    
     # Get bot token from environment variable
     bot_token = os.getenv("TELEGRAM_BOT_TOKEN")
     if not bot_token:
         logger.error("TELEGRAM_BOT_TOKEN environment variable not set")
         return
+    startup_report.mark("config")
+    
+    # Map the shared content file now, building it if this is the first start after a change
+    get_catalog()
+    startup_report.mark("content")
     
     # Create application
-    application = Application.builder().token(bot_token).build()
-    
-    # Add command handlers
-    application.add_handler(CommandHandler("start", start_command))
-    application.add_handler(CommandHandler("startgame", startgame_command))
-    application.add_handler(CommandHandler("join", join_command))
-    application.add_handler(CommandHandler("status", status_command))
-    application.add_handler(CommandHandler("roles", roles_command))
-    application.add_handler(CommandHandler("help", help_command))
-    application.add_handler(CommandHandler("settings", settings_command))
-    application.add_handler(CommandHandler("closeregistration", close_registration_command))
+    request, get_updates_request = build_requests(warm, startup_report)
+    application = (
+        Application.builder()
+        .token(bot_token)
+        .request(request)
+        .get_updates_request(get_updates_request)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
     
-    # Admin cheat commands (hidden)
-    application.add_handler(CommandHandler("adminrat", admin_reveal_rat))
-    application.add_handler(CommandHandler("adminskip", admin_skip_phase))
-    application.add_handler(CommandHandler("adminend", admin_end_game))
+    # Flood control runs before every other handler group
+    application.add_handler(TypeHandler(Update, flood_guard), group=-1)
+    application.add_handlers([CommandHandler(command, traced_handler(callback)) for command, callback in COMMAND_HANDLERS])
     
-    # Add callback query handler for voting
-    application.add_handler(CallbackQueryHandler(vote_callback))
+    # Add callback query handlers for voting, ready and settings buttons
+    application.add_handler(CallbackQueryHandler(traced_handler(vote_callback), pattern="^vote_"))
+    application.add_handler(CallbackQueryHandler(traced_handler(ready_callback), pattern="^ready"))
+    application.add_handler(CallbackQueryHandler(traced_handler(settings_callback), pattern="^(set_|toggle_)"))
+    startup_report.mark("handler setup")
     
     # Start the bot
     logger.info("Starting bot...")
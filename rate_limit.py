@@ -0,0 +1,192 @@
+"""
+Rate Limit - Per-user inbound flood control, callback debouncing and outbound pacing
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, Optional, Tuple
+
+from config import FLOOD_CONFIG, OUTBOUND_CONFIG
+
+
+class TokenBucketLimiter:
+    """Token bucket per key, stored as a single float per key.
+
+    Uses the GCRA formulation of the token bucket: instead of a token count
+    and a timestamp, each key keeps only its "theoretical arrival time".
+    A key whose arrival time is in the past has a full bucket and carries
+    no information, so it is dropped; memory is bounded by the number of
+    keys that were active within the last ``burst / rate`` seconds.
+    """
+
+    def __init__(self, rate: float, burst: int, max_entries: int):
+        self.interval = 1.0 / rate
+        self.tolerance = self.interval * (burst - 1)
+        self.max_entries = max_entries
+        self._tat: "OrderedDict[Hashable, float]" = OrderedDict()
+
+    def allow(self, key: Hashable, now: Optional[float] = None) -> bool:
+        """Take one token for the key; return False if the bucket is empty"""
+        now = time.monotonic() if now is None else now
+        self._expire(now)
+
+        tat = self._tat.get(key, now)
+        if tat < now:
+            tat = now
+        if tat - now > self.tolerance:
+            return False
+
+        self._tat[key] = tat + self.interval
+        self._tat.move_to_end(key)
+        if len(self._tat) > self.max_entries:
+            self._tat.popitem(last=False)
+        return True
+
+    def reserve(self, key: Hashable, now: Optional[float] = None) -> float:
+        """Take the key's next token even if it is not due yet; return seconds until it is.
+
+        Callers that wait out the returned delay are served in call order.
+        """
+        now = time.monotonic() if now is None else now
+        self._expire(now)
+
+        tat = self._tat.get(key, now)
+        if tat < now:
+            tat = now
+        wait = max(0.0, tat - now - self.tolerance)
+
+        self._tat[key] = tat + self.interval
+        self._tat.move_to_end(key)
+        if len(self._tat) > self.max_entries:
+            self._tat.popitem(last=False)
+        return wait
+
+    def delay(self, key: Hashable, now: Optional[float] = None) -> float:
+        """Seconds until the key gets its next token"""
+        now = time.monotonic() if now is None else now
+        tat = self._tat.get(key, now)
+        return max(0.0, tat - now - self.tolerance)
+
+    def _expire(self, now: float):
+        """Drop least recently used keys whose bucket has refilled"""
+        entries = self._tat
+        while entries:
+            key, tat = next(iter(entries.items()))
+            if tat > now:
+                break
+            del entries[key]
+
+    def __len__(self) -> int:
+        return len(self._tat)
+
+
+class CallbackDebouncer:
+    """Detects repeated taps on the same inline button within a short window"""
+
+    def __init__(self, window: float, max_entries: int):
+        self.window = window
+        self.max_entries = max_entries
+        self._seen: "OrderedDict[Hashable, float]" = OrderedDict()
+
+    def is_repeat(self, key: Hashable, now: Optional[float] = None) -> bool:
+        """Record a tap; return True if the same tap was seen within the window"""
+        now = time.monotonic() if now is None else now
+
+        # Entries are kept in insertion order with a fixed window, so expired ones are at the front
+        entries = self._seen
+        while entries:
+            oldest, expires = next(iter(entries.items()))
+            if expires > now:
+                break
+            del entries[oldest]
+
+        if key in entries:
+            return True
+
+        entries[key] = now + self.window
+        if len(entries) > self.max_entries:
+            entries.popitem(last=False)
+        return False
+
+    def __len__(self) -> int:
+        return len(self._seen)
+
+
+class OutboundLimiter:
+    """Paces outgoing messages under the per-chat and global send limits.
+
+    Sends are delayed rather than rejected with a 429. Sends to one chat
+    wait their turn in order, and a send takes the chat's token only when
+    it actually goes out, after any wait for the global limit, so a late
+    send never lets the next ones bunch up. All forum topics of a
+    supergroup share the chat's limit.
+    """
+
+    def __init__(self, chat_rate: float, chat_burst: int, global_rate: float, global_burst: int,
+                 max_entries: int):
+        self.chats = TokenBucketLimiter(chat_rate, chat_burst, max_entries)
+        self.total = TokenBucketLimiter(global_rate, global_burst, 1)
+        self._queues: Dict[int, Tuple[asyncio.Lock, int]] = {}  # chat_id -> (turn lock, sends waiting)
+
+    @classmethod
+    def unlimited(cls) -> "OutboundLimiter":
+        """Limiter that never waits, for tools that drive games against a fake bot"""
+        return cls(float("inf"), 1, float("inf"), 1, 1)
+
+    def backlog(self, chat_id: int) -> float:
+        """Roughly how many seconds a message to the chat would wait now"""
+        _, waiting = self._queues.get(chat_id, (None, 0))
+        return self.chats.delay(chat_id) + waiting * self.chats.interval
+
+    async def _global_turn(self):
+        delay = self.total.reserve(None)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def wait(self, chat_id: Optional[int]) -> float:
+        """Sleep until a send to the chat, or a private message when None, is allowed.
+
+        The caller must send right after; returns the time waited.
+        """
+        started = time.monotonic()
+        if chat_id is None:
+            await self._global_turn()
+            return time.monotonic() - started
+
+        lock, waiting = self._queues.get(chat_id) or (asyncio.Lock(), 0)
+        self._queues[chat_id] = (lock, waiting + 1)
+        try:
+            async with lock:
+                delay = self.chats.delay(chat_id)
+                while delay > 0:
+                    await asyncio.sleep(delay)
+                    delay = self.chats.delay(chat_id)
+                await self._global_turn()
+                self.chats.reserve(chat_id)
+        finally:
+            lock, waiting = self._queues[chat_id]
+            if waiting > 1:
+                self._queues[chat_id] = (lock, waiting - 1)
+            else:
+                del self._queues[chat_id]
+        return time.monotonic() - started
+
+
+def user_chat_key(user_id: int, chat_id: int) -> int:
+    """Pack a user and chat id into one int key"""
+    return (user_id << 64) | (chat_id & 0xFFFFFFFFFFFFFFFF)
+
+
+def create_flood_limiter() -> TokenBucketLimiter:
+    return TokenBucketLimiter(FLOOD_CONFIG["rate"], FLOOD_CONFIG["burst"], FLOOD_CONFIG["max_entries"])
+
+
+def create_callback_debouncer() -> CallbackDebouncer:
+    return CallbackDebouncer(FLOOD_CONFIG["callback_debounce"], FLOOD_CONFIG["max_entries"])
+
+
+def create_outbound_limiter() -> OutboundLimiter:
+    return OutboundLimiter(OUTBOUND_CONFIG["chat_rate"], OUTBOUND_CONFIG["chat_burst"],
+                           OUTBOUND_CONFIG["global_rate"], OUTBOUND_CONFIG["global_burst"],
+                           OUTBOUND_CONFIG["max_entries"])
@@ -0,0 +1,112 @@
+"""
+Reachability - Negative cache of users and chats the bot cannot message
+"""
+
+from __future__ import annotations
+
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Optional
+
+from config import REACHABILITY_CONFIG
+
+if TYPE_CHECKING:
+    from telegram.error import TelegramError
+
+# BadRequest texts that mean the recipient is gone rather than the request being malformed
+_DEAD_CHAT_MARKERS = ("chat not found", "user not found", "peer_id_invalid", "group chat was deactivated")
+
+# BadRequest texts that mean a forum topic was deleted or closed while the chat itself is fine
+_GONE_TOPIC_MARKERS = ("message thread not found", "topic_deleted", "topic_closed")
+
+
+def is_unreachable_error(error: Exception) -> bool:
+    """Check whether a send error means the recipient cannot be messaged"""
+    from telegram.error import BadRequest, Forbidden
+
+    if isinstance(error, Forbidden):
+        return True
+    if isinstance(error, BadRequest):
+        text = str(error).lower()
+        return any(marker in text for marker in _DEAD_CHAT_MARKERS)
+    return False
+
+
+def is_gone_topic_error(error: Exception) -> bool:
+    """Check whether a send error means the forum topic can no longer be posted to"""
+    from telegram.error import BadRequest
+
+    return isinstance(error, BadRequest) and any(marker in str(error).lower() for marker in _GONE_TOPIC_MARKERS)
+
+
+class TTLCache:
+    """Bounded set of ids that expire after a fixed time-to-live"""
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._expiry: "OrderedDict[int, float]" = OrderedDict()
+
+    def add(self, key: int, now: Optional[float] = None):
+        now = time.monotonic() if now is None else now
+        self._expiry[key] = now + self.ttl
+        self._expiry.move_to_end(key)
+        while len(self._expiry) > self.max_entries:
+            self._expiry.popitem(last=False)
+
+    def discard(self, key: int):
+        self._expiry.pop(key, None)
+
+    def __contains__(self, key: int) -> bool:
+        expires = self._expiry.get(key)
+        if expires is None:
+            return False
+        if expires <= time.monotonic():
+            del self._expiry[key]
+            return False
+        return True
+
+    def __len__(self) -> int:
+        return len(self._expiry)
+
+
+class ReachabilityCache:
+    """Remembers users who can't receive DMs and chats the bot was removed from"""
+
+    def __init__(self, config: Optional[dict] = None):
+        config = config or REACHABILITY_CONFIG
+        self.users = TTLCache(config["user_ttl"], config["max_entries"])
+        self.chats = TTLCache(config["chat_ttl"], config["max_entries"])
+
+    def is_user_unreachable(self, user_id: int) -> bool:
+        return user_id in self.users
+
+    def is_chat_dead(self, chat_id: int) -> bool:
+        return chat_id in self.chats
+
+    def mark_user_unreachable(self, user_id: int):
+        self.users.add(user_id)
+
+    def mark_user_reachable(self, user_id: int):
+        """Forget a user, e.g. after they opened a private chat with the bot"""
+        self.users.discard(user_id)
+
+    def mark_chat_dead(self, chat_id: int):
+        self.chats.add(chat_id)
+
+    def mark_chat_alive(self, chat_id: int):
+        self.chats.discard(chat_id)
+
+    def record_user_error(self, user_id: int, error: TelegramError) -> bool:
+        """Cache the user if the error means DMs can't reach them"""
+        if is_unreachable_error(error):
+            self.mark_user_unreachable(user_id)
+            return True
+        return False
+
+    def record_chat_error(self, chat_id: int, error: TelegramError) -> bool:
+        """Cache the chat if the error means the bot can no longer post there"""
+        if is_unreachable_error(error):
+            self.mark_chat_dead(chat_id)
+            return True
+        return False
@@ -0,0 +1,341 @@
+"""
+Redis Stand-in - Small in-process Redis-protocol server for local runs and checks
+
+Implements the subset of commands RedisBackend uses, including key expiry
+and WATCH/MULTI/EXEC. Run ``python redis_standin.py --failover-check`` to
+verify that a second bot instance takes over a game when the first one dies.
+"""
+
+import asyncio
+import sys
+import time
+from typing import Dict, List, Optional, Set
+
+
+class LocalRedisServer:
+    """Single-threaded asyncio server speaking the Redis serialization protocol"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.host = host
+        self.port = port
+        self.data: Dict[bytes, object] = {}
+        self.expires: Dict[bytes, float] = {}
+        self.versions: Dict[bytes, int] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._connections: Set[asyncio.Task] = set()
+
+    async def start(self) -> int:
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self.port
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            for task in list(self._connections):
+                task.cancel()
+            await asyncio.gather(*self._connections, return_exceptions=True)
+            await self._server.wait_closed()
+
+    @property
+    def url(self) -> str:
+        return f"redis://{self.host}:{self.port}/0"
+
+    # Keyspace helpers
+
+    def _touch(self, key: bytes):
+        self.versions[key] = self.versions.get(key, 0) + 1
+
+    def _alive(self, key: bytes) -> bool:
+        expires = self.expires.get(key)
+        if expires is not None and expires <= time.monotonic():
+            del self.expires[key]
+            self.data.pop(key, None)
+            self._touch(key)
+        return key in self.data
+
+    def _get(self, key: bytes, kind: type, create: bool = False):
+        if not self._alive(key):
+            if not create:
+                return None
+            self.data[key] = kind()
+        value = self.data[key]
+        if not isinstance(value, kind):
+            raise TypeError("WRONGTYPE Operation against a key holding the wrong kind of value")
+        return value
+
+    def _delete(self, key: bytes) -> bool:
+        existed = self._alive(key)
+        self.data.pop(key, None)
+        self.expires.pop(key, None)
+        if existed:
+            self._touch(key)
+        return existed
+
+    # Protocol
+
+    async def _read_command(self, reader: asyncio.StreamReader) -> Optional[List[bytes]]:
+        line = await reader.readline()
+        if not line:
+            return None
+        count = int(line[1:-2])
+        args = []
+        for _ in range(count):
+            length = int((await reader.readline())[1:-2])
+            args.append((await reader.readexactly(length + 2))[:-2])
+        return args
+
+    def _encode(self, value) -> bytes:
+        if value is None:
+            return b"$-1\r\n"
+        if isinstance(value, bool):
+            return b":%d\r\n" % int(value)
+        if isinstance(value, int):
+            return b":%d\r\n" % value
+        if isinstance(value, Exception):
+            return b"-%s\r\n" % str(value).encode()
+        if isinstance(value, str):
+            return b"+%s\r\n" % value.encode()
+        if isinstance(value, bytes):
+            return b"$%d\r\n%s\r\n" % (len(value), value)
+        if isinstance(value, list):
+            return b"*%d\r\n" % len(value) + b"".join(self._encode(v) for v in value)
+        raise TypeError(f"Cannot encode {value!r}")
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        session = {"watched": {}, "queue": None}
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            while True:
+                args = await self._read_command(reader)
+                if args is None:
+                    break
+                writer.write(self._encode(self._dispatch(session, args)))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+    def _dispatch(self, session: dict, args: List[bytes]):
+        name = args[0].upper().decode()
+        queue = session["queue"]
+        if queue is not None and name not in ("EXEC", "DISCARD", "MULTI", "WATCH"):
+            queue.append((name, args[1:]))
+            return "QUEUED"
+
+        if name == "MULTI":
+            session["queue"] = []
+            return "OK"
+        if name == "DISCARD":
+            session["queue"] = None
+            session["watched"] = {}
+            return "OK"
+        if name == "WATCH":
+            for key in args[1:]:
+                self._alive(key)
+                session["watched"][key] = self.versions.get(key, 0)
+            return "OK"
+        if name == "UNWATCH":
+            session["watched"] = {}
+            return "OK"
+        if name == "EXEC":
+            if queue is None:
+                return RuntimeError("ERR EXEC without MULTI")
+            watched, session["watched"], session["queue"] = session["watched"], {}, None
+            for key, version in watched.items():
+                self._alive(key)
+                if self.versions.get(key, 0) != version:
+                    return None
+            return [self._run(cmd, cmd_args) for cmd, cmd_args in queue]
+        return self._run(name, args[1:])
+
+    def _run(self, name: str, args: List[bytes]):
+        handler = getattr(self, f"_cmd_{name.lower()}", None)
+        if handler is None:
+            return RuntimeError(f"ERR unknown command '{name}'")
+        try:
+            return handler(*args)
+        except TypeError as e:
+            return RuntimeError(str(e) if "WRONGTYPE" in str(e) else f"ERR wrong arguments for '{name}'")
+
+    # Commands
+
+    def _cmd_ping(self, *args):
+        return "PONG"
+
+    def _cmd_select(self, db):
+        return "OK"
+
+    def _cmd_flushall(self, *args):
+        for key in list(self.data):
+            self._delete(key)
+        return "OK"
+
+    def _cmd_get(self, key):
+        return self._get(key, bytes)
+
+    def _cmd_mget(self, *keys):
+        return [self.data[key] if self._alive(key) and isinstance(self.data[key], bytes) else None
+                for key in keys]
+
+    def _cmd_set(self, key, value, *options):
+        options = [o.upper() for o in options]
+        ttl = None
+        if b"PX" in options:
+            ttl = int(options[options.index(b"PX") + 1]) / 1000
+        elif b"EX" in options:
+            ttl = int(options[options.index(b"EX") + 1])
+        exists = self._alive(key)
+        if (b"NX" in options and exists) or (b"XX" in options and not exists):
+            return None
+        self.data[key] = value
+        self.expires.pop(key, None)
+        if ttl is not None:
+            self.expires[key] = time.monotonic() + ttl
+        self._touch(key)
+        return "OK"
+
+    def _cmd_del(self, *keys):
+        return sum(self._delete(key) for key in keys)
+
+    def _cmd_pexpire(self, key, ms):
+        if not self._alive(key):
+            return 0
+        self.expires[key] = time.monotonic() + int(ms) / 1000
+        self._touch(key)
+        return 1
+
+    def _cmd_hset(self, key, *pairs):
+        table = self._get(key, dict, create=True)
+        added = 0
+        for field, value in zip(pairs[::2], pairs[1::2]):
+            added += field not in table
+            table[field] = value
+        self._touch(key)
+        return added
+
+    def _cmd_hsetnx(self, key, field, value):
+        table = self._get(key, dict, create=True)
+        if field in table:
+            return 0
+        table[field] = value
+        self._touch(key)
+        return 1
+
+    def _cmd_hdel(self, key, *fields):
+        table = self._get(key, dict)
+        if table is None:
+            return 0
+        removed = sum(table.pop(field, None) is not None for field in fields)
+        if not table:
+            self._delete(key)
+        elif removed:
+            self._touch(key)
+        return removed
+
+    def _cmd_hgetall(self, key):
+        table = self._get(key, dict) or {}
+        return [x for item in table.items() for x in item]
+
+    def _cmd_hlen(self, key):
+        return len(self._get(key, dict) or {})
+
+    def _cmd_sadd(self, key, *members):
+        members_set: Set[bytes] = self._get(key, set, create=True)
+        added = len(set(members) - members_set)
+        members_set.update(members)
+        self._touch(key)
+        return added
+
+    def _cmd_srem(self, key, *members):
+        members_set = self._get(key, set)
+        if members_set is None:
+            return 0
+        removed = len(members_set & set(members))
+        members_set.difference_update(members)
+        if not members_set:
+            self._delete(key)
+        elif removed:
+            self._touch(key)
+        return removed
+
+    def _cmd_smembers(self, key):
+        return sorted(self._get(key, set) or ())
+
+
+async def failover_check() -> bool:
+    """Run a game on one instance, kill it and check that another one finishes the game"""
+    from unittest import mock
+
+    from config import GAME_CONFIG
+    from fake_telegram import FakeBot, FakeContext
+    from game_manager import GameManager
+    from game_state import GameKey
+    from rate_limit import OutboundLimiter
+    from state_backend import RedisBackend
+
+    server = LocalRedisServer()
+    await server.start()
+    lease_ttl = 0.5
+    timings = {
+        "registration_time": 0.2, "discussion_time": 0.3, "voting_time": 0.3, "enable_taunts": False,
+    }
+    key = GameKey(-100500, 7)  # A forum topic, to exercise composite keys
+
+    with mock.patch.dict(GAME_CONFIG, timings):
+        first = GameManager(RedisBackend(server.url), lease_ttl=lease_ttl)
+        second = GameManager(RedisBackend(server.url), lease_ttl=lease_ttl)
+        first.outbound = second.outbound = OutboundLimiter.unlimited()
+        first_context = FakeContext(FakeBot(record=True))
+        second_context = FakeContext(FakeBot(record=True))
+        await first.start(first_context)
+        await second.start(second_context)
+
+        ok, _ = await first.start_game(key, 1, "alice", first_context)
+        assert ok, "first instance could not start a game"
+        for user_id, name in [(2, "bob"), (3, "carol"), (4, "dave")]:
+            ok, message = await second.join_game(key, user_id, name)
+            assert ok, message
+        assert key in first.leases and key not in second.leases
+
+        # Let the first instance close registration and open the discussion
+        while (await second.load_game(key)).phase != "discussion":
+            await asyncio.sleep(0.05)
+
+        # Simulate a crash: stop everything without releasing the lease
+        for task in first._lease_tasks:
+            task.cancel()
+        for task in [*first.timer_tasks.values(), *first.taunt_tasks.values()]:
+            task.cancel()
+        await first.backend.close()
+        crashed_at = time.monotonic()
+
+        while key not in second.leases:
+            await asyncio.sleep(0.05)
+        takeover = time.monotonic() - crashed_at
+
+        while (await second.load_game(key)).phase != "voting":
+            await asyncio.sleep(0.05)
+        voting_sent = any("Голосование" in text for _, text in second_context.bot.sent)
+
+        await second.shutdown()
+        await server.stop()
+
+    print(f"Lease taken over after {takeover:.2f}s (ttl {lease_ttl}s); second instance opened voting: {voting_sent}")
+    return voting_sent and takeover < lease_ttl * 3
+
+
+async def _serve_forever(port: int):
+    server = LocalRedisServer(port=port)
+    await server.start()
+    print(f"Redis stand-in listening on {server.url}")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    if "--failover-check" in sys.argv:
+        sys.exit(0 if asyncio.run(failover_check()) else 1)
+    asyncio.run(_serve_forever(int(sys.argv[1]) if len(sys.argv) > 1 else 6379))
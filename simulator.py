@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+"""
+Simulator - Vectorized Monte Carlo model of the game rules for balance tuning
+
+Plays many games at once on NumPy arrays, one row per game, with the rules
+of GameState.assign_roles and GameManager.process_votes: one rat chosen
+uniformly, the most voted player is eliminated (a tie goes to the target
+whose first vote came earliest), the town wins when the rat is eliminated,
+the rat wins when two or fewer players are left, and a round without votes
+ends the game.
+
+Game lengths follow the early completion rules: a discussion ends once the
+ready quorum has pressed "ready" and a voting once its outcome is settled.
+Players press "ready" and vote at uniformly random times within the phase.
+With --no-early, phases run to their deadline unless every vote is in, as
+before early completion.
+
+Usage:
+    python simulator.py                               # random votes, 1M games per player count
+    python simulator.py --strategy biased --accuracy 0.4
+    python simulator.py --games 100000 --turnout 0.8
+    python simulator.py --cross-check                 # compare with the real GameManager
+    python simulator.py --no-early                    # game lengths without early completion
+
+Needs NumPy: pip install numpy
+"""
+
+import argparse
+import asyncio
+import math
+import sys
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+try:
+    import numpy as np
+except ImportError as e:
+    raise ImportError("The simulator needs NumPy: pip install numpy") from e
+
+from config import GAME_CONFIG
+
+# The rat wins once this many players or fewer are alive (GameManager.process_votes)
+RAT_WINS_AT = 2
+
+# Game outcomes
+ONGOING, TOWN_WIN, RAT_WIN, NO_VOTES = 0, 1, 2, 3
+
+# Every round either ends the game or removes exactly one player, so all games
+# in a batch have the same number of alive players. They are renumbered
+# 0..alive-1 each round; a strategy gets the rat's number per game and
+# returns the number each player votes for (games x alive).
+Strategy = Callable[[np.random.Generator, np.ndarray, int], np.ndarray]
+
+
+def random_other(rng: np.random.Generator, games: int, alive: int) -> np.ndarray:
+    """For every player, a uniformly random other player"""
+    pick = rng.integers(0, alive - 1, (games, alive))
+    pick += pick >= np.arange(alive)
+    return pick
+
+
+def random_votes() -> Strategy:
+    """Everyone votes for a random other player"""
+    def choose(rng, rat, alive):
+        return random_other(rng, rat.size, alive)
+    return choose
+
+
+def rat_biased(accuracy: float) -> Strategy:
+    """Town players spot the rat with probability ``accuracy``, otherwise vote at random.
+
+    The rat always votes at random.
+    """
+    def choose(rng, rat, alive):
+        targets = random_other(rng, rat.size, alive)
+        spotted = (rng.random(targets.shape) < accuracy) & (np.arange(alive) != rat[:, None])
+        return np.where(spotted, rat[:, None], targets)
+    return choose
+
+
+STRATEGIES: Dict[str, Callable[[float], Strategy]] = {
+    "random": lambda accuracy: random_votes(),
+    "biased": rat_biased,
+}
+
+
+@dataclass
+class SimulationResult:
+    """Outcome counts and game lengths for one player count"""
+    players: int
+    games: int
+    town_wins: int
+    rat_wins: int
+    no_votes: int
+    mean_rounds: float
+    mean_seconds: float
+    p90_seconds: float
+
+    @property
+    def rat_win_rate(self) -> float:
+        return self.rat_wins / self.games
+
+
+def eliminate(targets: np.ndarray, voted: np.ndarray, arrival: np.ndarray) -> np.ndarray:
+    """Number of the eliminated player per game, -1 where nobody voted.
+
+    A tie goes to the target whose first vote arrived earliest, like the
+    insertion-ordered ``max`` in process_votes.
+    """
+    games, alive = targets.shape
+    rows = np.arange(games)
+    slots = rows[:, None] * alive + targets
+    counts = np.bincount(slots[voted], minlength=games * alive)
+    most = counts.reshape(games, alive).max(axis=1)
+
+    leading = voted & (counts[slots] == most[:, None])
+    first = np.where(leading, arrival, np.inf).argmin(axis=1)
+    return np.where(most > 0, targets[rows, first], -1)
+
+
+def discussion_length(rng: np.random.Generator, games: int, alive: int, turnout: float,
+                      discussion_time: float, quorum: float) -> np.ndarray:
+    """Seconds until the ready quorum has pressed "ready", or the full discussion, per game"""
+    needed = max(1, math.ceil(alive * quorum))
+    pressed = rng.random((games, alive), dtype=np.float32) < turnout
+    ready_at = np.where(pressed, rng.random((games, alive), dtype=np.float32) * np.float32(discussion_time), np.inf)
+    return np.minimum(np.partition(ready_at, needed - 1, axis=1)[:, needed - 1], discussion_time)
+
+
+def settled_at(targets: np.ndarray, voted: np.ndarray, arrival: np.ndarray, voting_time: float) -> np.ndarray:
+    """Seconds until the voting outcome is settled, or the full voting, per game.
+
+    Settled as in GameState.voting_decided: the leader has more votes than
+    the runner-up could reach with every missing vote.
+    """
+    games, alive = targets.shape
+    rows = np.arange(games)
+    order = np.argsort(np.where(voted, arrival, np.inf), axis=1)
+    counts = np.zeros((games, alive), dtype=np.int32)
+    closed = np.full(games, float(voting_time))
+    pending = np.ones(games, dtype=bool)
+    for cast_so_far, column in enumerate(order.T, 1):
+        cast = voted[rows, column]
+        counts[rows[cast], targets[rows, column][cast]] += 1
+        top = np.partition(counts, alive - 2, axis=1)
+        decided = pending & cast & (top[:, -1] > top[:, -2] + alive - cast_so_far)
+        closed[decided] = arrival[rows, column][decided]
+        pending &= ~decided
+    return closed
+
+
+def simulate_batch(rng: np.random.Generator, players: int, games: int, strategy: Strategy,
+                   turnout: float = 1.0, config: Optional[dict] = None, early: bool = True):
+    """Play ``games`` games of ``players`` players; returns outcome, rounds and seconds per game"""
+    config = config or GAME_CONFIG
+    voting_time = config["voting_time"]
+    outcome = np.zeros(games, dtype=np.int8)
+    rounds = np.zeros(games, dtype=np.int32)
+    seconds = np.full(games, float(config["registration_time"]))
+
+    active = np.arange(games)
+    rat = rng.integers(0, players, games)
+    alive = players
+    while active.size:
+        targets = strategy(rng, rat, alive)
+        voted = rng.random(targets.shape, dtype=np.float32) < turnout
+        arrival = rng.random(targets.shape, dtype=np.float32) * np.float32(voting_time)
+
+        if early:
+            seconds[active] += discussion_length(rng, active.size, alive, turnout, config["discussion_time"],
+                                                 config["ready_quorum"])
+            seconds[active] += settled_at(targets, voted, arrival, voting_time)
+        else:
+            # Voting closes on the last vote when everyone voted, otherwise on the timer
+            everyone = voted.all(axis=1)
+            duration = np.where(everyone, arrival.max(axis=1), voting_time)
+            seconds[active] += config["discussion_time"] + duration
+        rounds[active] += 1
+
+        eliminated = eliminate(targets, voted, arrival)
+        alive -= 1
+        no_votes = eliminated < 0
+        town_win = eliminated == rat
+        rat_win = ~no_votes & ~town_win & (alive <= RAT_WINS_AT)
+        outcome[active[no_votes]] = NO_VOTES
+        outcome[active[town_win]] = TOWN_WIN
+        outcome[active[rat_win]] = RAT_WIN
+
+        # Renumber: the last player takes the eliminated player's number
+        going_on = ~(no_votes | town_win | rat_win)
+        rat = np.where(rat == alive, eliminated, rat)[going_on]
+        active = active[going_on]
+
+    return outcome, rounds, seconds
+
+
+def simulate(players: int, games: int, strategy: Strategy, turnout: float = 1.0,
+             batch_size: int = 200_000, seed: Optional[int] = None,
+             config: Optional[dict] = None, early: bool = True) -> SimulationResult:
+    """Play ``games`` games in batches and summarize them"""
+    rng = np.random.default_rng(seed)
+    outcomes, rounds, seconds = [], [], []
+    for start in range(0, games, batch_size):
+        batch = simulate_batch(rng, players, min(batch_size, games - start), strategy, turnout, config, early)
+        outcomes.append(batch[0])
+        rounds.append(batch[1])
+        seconds.append(batch[2])
+    outcome = np.concatenate(outcomes)
+    length = np.concatenate(seconds)
+    return SimulationResult(
+        players=players,
+        games=games,
+        town_wins=int((outcome == TOWN_WIN).sum()),
+        rat_wins=int((outcome == RAT_WIN).sum()),
+        no_votes=int((outcome == NO_VOTES).sum()),
+        mean_rounds=float(np.concatenate(rounds).mean()),
+        mean_seconds=float(length.mean()),
+        p90_seconds=float(np.percentile(length, 90)),
+    )
+
+
+async def play_real_games(players: int, games: int, strategy: Strategy, turnout: float = 1.0,
+                          seed: Optional[int] = None) -> dict:
+    """Play games through the real GameManager with votes from ``strategy``.
+
+    Phases are advanced directly instead of waiting for timers, the way
+    /closeregistration and a full set of votes do.
+    """
+    from unittest import mock
+
+    from fake_telegram import FakeContext
+    from game_manager import GameManager
+    from game_state import GameKey
+    from rate_limit import OutboundLimiter
+    from state_backend import InMemoryBackend
+
+    rng = np.random.default_rng(seed)
+    context = FakeContext()
+    counts = {TOWN_WIN: 0, RAT_WIN: 0, NO_VOTES: 0}
+    total_rounds = 0
+    timers = {"registration_time": 3600, "discussion_time": 3600, "voting_time": 3600, "enable_taunts": False}
+
+    with mock.patch.dict(GAME_CONFIG, timers):
+        manager = GameManager(InMemoryBackend())
+        manager.outbound = OutboundLimiter.unlimited()
+        for i in range(games):
+            key = GameKey(-100 - i)
+            await manager.start_game(key, 1, "player1", context)
+            for user_id in range(2, players + 1):
+                await manager.join_game(key, user_id, f"player{user_id}")
+            await manager._start_game_phase(key, context)
+
+            game = manager.games[key]
+            while game.phase != "ended":
+                await manager._start_voting_phase(key, context)
+                alive = game.get_alive_players()
+                rat = np.array([next(i for i, p in enumerate(alive) if p.is_rat)])
+                targets = strategy(rng, rat, len(alive))[0]
+                for voter in rng.permutation(len(alive)):
+                    if rng.random() < turnout:
+                        await manager.cast_vote(key, alive[voter].user_id, alive[targets[voter]].user_id, context)
+                had_votes = bool(game.votes)
+                await manager.process_votes(key, context)
+                total_rounds += 1
+
+                # The next round's discussion is started from a task
+                pending = manager.timer_tasks.get(key)
+                if game.phase != "ended" and pending is not None:
+                    await pending
+
+            if not had_votes:
+                counts[NO_VOTES] += 1
+            elif game.get_rat_player().alive:
+                counts[RAT_WIN] += 1
+            else:
+                counts[TOWN_WIN] += 1
+
+        for task in [*manager.timer_tasks.values(), *manager.taunt_tasks.values()]:
+            task.cancel()
+
+    return {"games": games, "rat_wins": counts[RAT_WIN], "town_wins": counts[TOWN_WIN],
+            "no_votes": counts[NO_VOTES], "mean_rounds": total_rounds / games}
+
+
+def cross_check(strategy_name: str = "random", accuracy: float = 0.5, turnout: float = 1.0,
+                games: int = 400, player_counts=(3, 4, 5, 6, 8)) -> bool:
+    """Compare rat win rates and round counts with games played by the real GameManager.
+
+    Passes when the real rate is within four standard errors of the
+    simulated one, and the mean round count within 10%.
+    """
+    strategy = STRATEGIES[strategy_name](accuracy)
+    ok = True
+    print(f"{'players':>7} {'sim rat win':>12} {'real rat win':>13} {'sim rounds':>11} {'real rounds':>12}")
+    for players in player_counts:
+        simulated = simulate(players, 200_000, strategy, turnout, seed=players)
+        real = asyncio.run(play_real_games(players, games, strategy, turnout, seed=players))
+
+        p = simulated.rat_win_rate
+        real_rate = real["rat_wins"] / games
+        tolerance = 4 * max((p * (1 - p) / games) ** 0.5, 1 / games)
+        matches = (abs(real_rate - p) <= tolerance
+                   and abs(real["mean_rounds"] - simulated.mean_rounds) <= 0.1 * simulated.mean_rounds)
+        ok &= matches
+        print(f"{players:>7} {p:>12.3f} {real_rate:>13.3f} {simulated.mean_rounds:>11.2f} "
+              f"{real['mean_rounds']:>12.2f}{'' if matches else '  MISMATCH'}")
+    return ok
+
+
+def _format_duration(seconds: float) -> str:
+    return f"{int(seconds // 60)}:{int(seconds % 60):02d}"
+
+
+def print_table(results: List[SimulationResult]):
+    print(f"{'players':>7} {'rat win':>8} {'town win':>9} {'no votes':>9} {'rounds':>7} {'length':>7} {'p90':>7}")
+    for r in results:
+        print(f"{r.players:>7} {r.rat_win_rate:>8.1%} {r.town_wins / r.games:>9.1%} {r.no_votes / r.games:>9.1%} "
+              f"{r.mean_rounds:>7.2f} {_format_duration(r.mean_seconds):>7} {_format_duration(r.p90_seconds):>7}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Monte Carlo balance simulator for the game rules")
+    parser.add_argument("--games", type=int, default=1_000_000, help="games per player count")
+    parser.add_argument("--players", type=int, nargs="*",
+                        help=f"player counts (default {GAME_CONFIG['min_players']}..{GAME_CONFIG['max_players']})")
+    parser.add_argument("--strategy", choices=sorted(STRATEGIES), default="random", help="voting strategy")
+    parser.add_argument("--accuracy", type=float, default=0.5, help="chance a town player spots the rat (biased)")
+    parser.add_argument("--turnout", type=float, default=1.0, help="chance an alive player votes in a round")
+    parser.add_argument("--seed", type=int, help="random seed")
+    parser.add_argument("--cross-check", action="store_true", help="compare with games run by GameManager")
+    parser.add_argument("--no-early", dest="early", action="store_false",
+                        help="game lengths without early completion of discussions and votes")
+    args = parser.parse_args()
+
+    if args.cross_check:
+        return 0 if cross_check(args.strategy, args.accuracy, args.turnout) else 1
+
+    player_counts = args.players or range(GAME_CONFIG["min_players"], GAME_CONFIG["max_players"] + 1)
+    strategy = STRATEGIES[args.strategy](args.accuracy)
+    started = time.perf_counter()
+    results = [simulate(n, args.games, strategy, args.turnout, seed=args.seed, early=args.early)
+               for n in player_counts]
+    print_table(results)
+    if args.early:
+        print(f"\nLengths with early completion: discussions end once {GAME_CONFIG['ready_quorum']:.0%} "
+              "of the players are ready, votes once their outcome is settled")
+    else:
+        print("\nLengths without early completion: phases run to their deadline unless every vote is in")
+    print(f"\n{len(results) * args.games:,} games in {time.perf_counter() - started:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
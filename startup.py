@@ -0,0 +1,91 @@
+"""
+Startup - Cold start helpers and the per-phase startup-time report
+
+Building the HTTP clients is the slowest part of a cold start after the
+telegram import itself: every client loads the CA bundle into its own SSL
+context and the first one pulls in the HTTP transport. ``warm_up`` does
+that work once on a background thread while the main thread imports
+telegram, and ``build_requests`` hands the result to both clients.
+"""
+
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from typing import List, Optional, Tuple
+
+
+class StartupReport:
+    """Records when each startup phase finished and prints the time spent in each"""
+
+    def __init__(self, started: float, enabled: bool = True):
+        self.enabled = enabled
+        self.started = started
+        self.phases: List[Tuple[str, float]] = []
+        self._printed = False
+
+    def mark(self, phase: str):
+        """Close the phase that is running now"""
+        if self.enabled and not self._printed:
+            self.phases.append((phase, time.perf_counter()))
+
+    def report(self) -> str:
+        lines = ["Startup report:"]
+        previous = self.started
+        for phase, finished in self.phases:
+            lines.append(f"  {phase:<16} {(finished - previous) * 1000:>8.1f} ms")
+            previous = finished
+        lines.append(f"  {'total':<16} {(previous - self.started) * 1000:>8.1f} ms")
+        return "\n".join(lines)
+
+    def finish(self, phase: str):
+        """Close the last phase and print the report once"""
+        if not self.enabled or self._printed:
+            return
+        self.mark(phase)
+        self._printed = True
+        print(self.report(), file=sys.stderr, flush=True)
+
+
+def _prepare_network():
+    import ssl
+
+    import certifi
+    import httpcore  # noqa: F401 - imported lazily by httpx on the first client otherwise
+
+    return ssl.create_default_context(cafile=certifi.where())
+
+
+def warm_up() -> "Future":
+    """Start building the shared SSL context in the background"""
+    future: Future = Future()
+
+    def run():
+        try:
+            future.set_result(_prepare_network())
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, name="startup-warm-up", daemon=True).start()
+    return future
+
+
+def build_requests(warm: "Future", report: Optional[StartupReport] = None):
+    """Request objects for bot calls and for getUpdates that share one SSL context.
+
+    Pool sizes match the ApplicationBuilder defaults. With a report, the
+    first getUpdates call closes the "first poll" phase.
+    """
+    from telegram.request import HTTPXRequest
+
+    class ReportingRequest(HTTPXRequest):
+        async def do_request(self, url: str, method: str, *args, **kwargs):
+            if url.endswith("/getUpdates"):
+                report.finish("first poll")
+            return await super().do_request(url, method, *args, **kwargs)
+
+    ssl_context = warm.result()
+    updates_class = ReportingRequest if report is not None and report.enabled else HTTPXRequest
+    request = HTTPXRequest(connection_pool_size=256, httpx_kwargs={"verify": ssl_context})
+    get_updates_request = updates_class(connection_pool_size=1, httpx_kwargs={"verify": ssl_context})
+    return request, get_updates_request
@@ -0,0 +1,419 @@
+"""
+State Backend - Pluggable storage for game state shared between bot instances
+
+``InMemoryBackend`` keeps games in process memory (a single instance).
+``RedisBackend`` speaks the Redis protocol so several instances can share
+games; each game is driven by the one instance holding its lease.
+"""
+
+import asyncio
+import contextlib
+import json
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from urllib.parse import urlparse
+
+from game_state import GameKey, GameState, Player
+from config import STATE_CONFIG
+
+
+class StateBackend(ABC):
+    """Storage interface used by GameManager"""
+
+    # Whether other processes can see and modify the same games
+    shared = False
+
+    @abstractmethod
+    async def load_game(self, key: GameKey) -> Optional[GameState]:
+        """Load the current state of a game"""
+
+    @abstractmethod
+    async def save_game(self, game: GameState):
+        """Store a full snapshot of a game"""
+
+    @abstractmethod
+    async def delete_game(self, key: GameKey):
+        """Remove a game"""
+
+    @abstractmethod
+    async def add_player(self, key: GameKey, user_id: int, username: str) -> Tuple[bool, Optional[GameState]]:
+        """Add a player if absent; return whether it was added and the game after the write"""
+
+    @abstractmethod
+    async def remove_player(self, key: GameKey, user_id: int):
+        """Undo an ``add_player`` that turned out to be invalid"""
+
+    @abstractmethod
+    async def record_vote(self, key: GameKey, voter_id: int, target_id: int) -> Optional[GameState]:
+        """Store a vote unless the voter already voted; return the game after the write"""
+
+    @abstractmethod
+    async def retract_vote(self, key: GameKey, voter_id: int):
+        """Undo a ``record_vote`` that turned out to be invalid"""
+
+    @abstractmethod
+    async def mark_ready(self, key: GameKey, user_id: int) -> Optional[GameState]:
+        """Mark a player ready to vote and return the game after the write"""
+
+    @abstractmethod
+    async def active_games(self) -> List[GameKey]:
+        """Games that have not ended"""
+
+    @abstractmethod
+    async def acquire_lease(self, key: GameKey, owner: str, ttl: float) -> bool:
+        """Take the lease of a game if nobody holds it"""
+
+    @abstractmethod
+    async def renew_leases(self, keys: Iterable[GameKey], owner: str, ttl: float) -> Set[GameKey]:
+        """Extend leases still held by the owner; return the ones that are"""
+
+    @abstractmethod
+    async def release_lease(self, key: GameKey, owner: str):
+        """Give up the lease of a game"""
+
+    @abstractmethod
+    async def unleased(self, keys: Iterable[GameKey]) -> List[GameKey]:
+        """The games among ``keys`` whose lease nobody holds"""
+
+    async def close(self):
+        """Release connections"""
+
+
+class InMemoryBackend(StateBackend):
+    """Games stored as live objects in this process"""
+
+    def __init__(self):
+        self.games: Dict[GameKey, GameState] = {}
+        self.leases: Dict[GameKey, Tuple[str, float]] = {}
+
+    async def load_game(self, key: GameKey) -> Optional[GameState]:
+        return self.games.get(key)
+
+    async def save_game(self, game: GameState):
+        self.games[game.key] = game
+
+    async def delete_game(self, key: GameKey):
+        self.games.pop(key, None)
+        self.leases.pop(key, None)
+
+    async def add_player(self, key: GameKey, user_id: int, username: str) -> Tuple[bool, Optional[GameState]]:
+        game = self.games.get(key)
+        if game is None:
+            return False, None
+        return game.add_player(user_id, username), game
+
+    async def remove_player(self, key: GameKey, user_id: int):
+        game = self.games.get(key)
+        if game is not None:
+            game.players.pop(user_id, None)
+
+    async def record_vote(self, key: GameKey, voter_id: int, target_id: int) -> Optional[GameState]:
+        game = self.games.get(key)
+        if game is not None:
+            game.votes.setdefault(voter_id, target_id)
+        return game
+
+    async def retract_vote(self, key: GameKey, voter_id: int):
+        game = self.games.get(key)
+        if game is not None:
+            game.votes.pop(voter_id, None)
+
+    async def mark_ready(self, key: GameKey, user_id: int) -> Optional[GameState]:
+        game = self.games.get(key)
+        if game is not None:
+            game.ready.add(user_id)
+        return game
+
+    async def active_games(self) -> List[GameKey]:
+        return [key for key, game in self.games.items() if game.phase != "ended"]
+
+    async def acquire_lease(self, key: GameKey, owner: str, ttl: float) -> bool:
+        now = time.monotonic()
+        holder = self.leases.get(key)
+        if holder is not None and holder[0] != owner and holder[1] > now:
+            return False
+        self.leases[key] = (owner, now + ttl)
+        return True
+
+    async def renew_leases(self, keys: Iterable[GameKey], owner: str, ttl: float) -> Set[GameKey]:
+        held = set()
+        for key in keys:
+            if await self.acquire_lease(key, owner, ttl):
+                held.add(key)
+        return held
+
+    async def release_lease(self, key: GameKey, owner: str):
+        holder = self.leases.get(key)
+        if holder is not None and holder[0] == owner:
+            del self.leases[key]
+
+    async def unleased(self, keys: Iterable[GameKey]) -> List[GameKey]:
+        now = time.monotonic()
+        return [key for key in keys if key not in self.leases or self.leases[key][1] <= now]
+
+
+class RespError(Exception):
+    """Error reply from a Redis-protocol server"""
+
+
+class RespClient:
+    """Minimal pipelining client for the Redis serialization protocol"""
+
+    def __init__(self, host: str, port: int, db: int = 0):
+        self.host = host
+        self.port = port
+        self.db = db
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._lock = asyncio.Lock()
+
+    async def _connect(self):
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        if self.db:
+            await self._roundtrip([("SELECT", self.db)])
+
+    @staticmethod
+    def _encode(command: tuple) -> bytes:
+        parts = [b"*%d\r\n" % len(command)]
+        for arg in command:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode()
+            parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        return b"".join(parts)
+
+    async def _read_reply(self):
+        line = await self._reader.readline()
+        if not line:
+            raise ConnectionError("Connection closed by server")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode()
+        if kind == b"-":
+            return RespError(payload.decode())
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            data = await self._reader.readexactly(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            length = int(payload)
+            if length < 0:
+                return None
+            return [await self._read_reply() for _ in range(length)]
+        raise RespError(f"Unexpected reply type {kind!r}")
+
+    async def _roundtrip(self, commands: List[tuple]) -> list:
+        self._writer.write(b"".join(self._encode(c) for c in commands))
+        await self._writer.drain()
+        return [await self._read_reply() for _ in commands]
+
+    def _disconnect(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+    async def _send(self, *commands: tuple) -> list:
+        try:
+            if self._writer is None:
+                await self._connect()
+            replies = await self._roundtrip(list(commands))
+        except BaseException:
+            # Replies left unread, as after a cancellation, would be read by the next command
+            self._disconnect()
+            raise
+        for reply in replies:
+            if isinstance(reply, RespError):
+                raise reply
+        return replies
+
+    async def pipeline(self, *commands: tuple) -> list:
+        """Send commands in one write and read all replies: one round-trip"""
+        async with self._lock:
+            return await self._send(*commands)
+
+    @contextlib.asynccontextmanager
+    async def exclusive(self):
+        """Hold the connection across several round-trips, for WATCH transactions"""
+        async with self._lock:
+            yield self._send
+
+    async def execute(self, *command):
+        return (await self.pipeline(tuple(command)))[0]
+
+    async def close(self):
+        self._disconnect()
+
+
+class RedisBackend(StateBackend):
+    """Games stored in a Redis-compatible server.
+
+    Each game is split into a metadata string, a players hash and a votes
+    hash, so joins and votes from any instance are single hash writes that
+    can't clobber each other. Reads and writes are pipelined: loading a
+    game, adding a player and recording a vote each take one round-trip.
+    """
+
+    shared = True
+
+    # Ended games are kept this long so /status still reports them
+    ENDED_TTL_MS = 3600 * 1000
+
+    def __init__(self, url: str, key_prefix: str = "rat:"):
+        parsed = urlparse(url)
+        db = int(parsed.path.lstrip("/") or 0)
+        self.client = RespClient(parsed.hostname or "127.0.0.1", parsed.port or 6379, db)
+        self.prefix = key_prefix
+
+    def _keys(self, key: GameKey) -> Tuple[str, str, str, str]:
+        return (
+            f"{self.prefix}game:{key}",
+            f"{self.prefix}players:{key}",
+            f"{self.prefix}votes:{key}",
+            f"{self.prefix}ready:{key}",
+        )
+
+    def _lease_key(self, key: GameKey) -> str:
+        return f"{self.prefix}lease:{key}"
+
+    @property
+    def _active_key(self) -> str:
+        return f"{self.prefix}active"
+
+    @staticmethod
+    def _decode_game(meta: Optional[bytes], players: list, votes: list, ready: list) -> Optional[GameState]:
+        if meta is None:
+            return None
+        data = json.loads(meta)
+        data["players"] = [json.loads(value) for value in players[1::2]]
+        data["votes"] = [[int(voter), int(target)] for voter, target in zip(votes[::2], votes[1::2])]
+        data["ready"] = [int(user_id) for user_id in ready]
+        return GameState.from_dict(data)
+
+    def _read_commands(self, key: GameKey) -> List[tuple]:
+        game_key, players_key, votes_key, ready_key = self._keys(key)
+        return [("GET", game_key), ("HGETALL", players_key), ("HGETALL", votes_key), ("SMEMBERS", ready_key)]
+
+    async def load_game(self, key: GameKey) -> Optional[GameState]:
+        return self._decode_game(*await self.client.pipeline(*self._read_commands(key)))
+
+    async def save_game(self, game: GameState):
+        game_key, players_key, votes_key, ready_key = self._keys(game.key)
+        data = game.to_dict()
+        players = data.pop("players")
+        votes = data.pop("votes")
+        ready = data.pop("ready")
+
+        commands = [("MULTI",), ("SET", game_key, json.dumps(data)), ("DEL", players_key, votes_key, ready_key)]
+        if players:
+            fields = []
+            for player in players:
+                fields += [player[0], json.dumps(player, ensure_ascii=False)]
+            commands.append(("HSET", players_key, *fields))
+        if votes:
+            commands.append(("HSET", votes_key, *[x for vote in votes for x in vote]))
+        if ready:
+            commands.append(("SADD", ready_key, *ready))
+        if game.phase == "ended":
+            commands.append(("SREM", self._active_key, str(game.key)))
+            for redis_key in (game_key, players_key, votes_key, ready_key):
+                commands.append(("PEXPIRE", redis_key, self.ENDED_TTL_MS))
+        else:
+            commands.append(("SADD", self._active_key, str(game.key)))
+        commands.append(("EXEC",))
+        await self.client.pipeline(*commands)
+
+    async def delete_game(self, key: GameKey):
+        await self.client.pipeline(
+            ("DEL", *self._keys(key), self._lease_key(key)),
+            ("SREM", self._active_key, str(key)),
+        )
+
+    async def add_player(self, key: GameKey, user_id: int, username: str) -> Tuple[bool, Optional[GameState]]:
+        players_key = self._keys(key)[1]
+        player = json.dumps(Player(user_id, username).to_list(), ensure_ascii=False)
+        added, *game = await self.client.pipeline(
+            ("HSETNX", players_key, user_id, player), *self._read_commands(key)
+        )
+        game = self._decode_game(*game)
+        if game is None and added:
+            await self.client.execute("DEL", players_key)
+            return False, None
+        return bool(added), game
+
+    async def remove_player(self, key: GameKey, user_id: int):
+        await self.client.execute("HDEL", self._keys(key)[1], user_id)
+
+    async def record_vote(self, key: GameKey, voter_id: int, target_id: int) -> Optional[GameState]:
+        _, *game = await self.client.pipeline(
+            ("HSETNX", self._keys(key)[2], voter_id, target_id), *self._read_commands(key)
+        )
+        return self._decode_game(*game)
+
+    async def retract_vote(self, key: GameKey, voter_id: int):
+        await self.client.execute("HDEL", self._keys(key)[2], voter_id)
+
+    async def mark_ready(self, key: GameKey, user_id: int) -> Optional[GameState]:
+        _, *game = await self.client.pipeline(("SADD", self._keys(key)[3], user_id), *self._read_commands(key))
+        return self._decode_game(*game)
+
+    async def active_games(self) -> List[GameKey]:
+        return [GameKey.parse(key.decode()) for key in await self.client.execute("SMEMBERS", self._active_key)]
+
+    async def acquire_lease(self, key: GameKey, owner: str, ttl: float) -> bool:
+        reply = await self.client.execute("SET", self._lease_key(key), owner, "NX", "PX", int(ttl * 1000))
+        return reply == "OK"
+
+    async def renew_leases(self, keys: Iterable[GameKey], owner: str, ttl: float) -> Set[GameKey]:
+        """Extend held leases atomically with WATCH/MULTI/EXEC, retrying on conflicts"""
+        games = list(keys)
+        if not games:
+            return set()
+
+        keys = [self._lease_key(key) for key in games]
+        async with self.client.exclusive() as send:
+            while True:
+                _, holders = await send(("WATCH", *keys), ("MGET", *keys))
+                held = [(game, key) for game, key, holder in zip(games, keys, holders)
+                        if holder is not None and holder.decode() == owner]
+                if not held:
+                    await send(("UNWATCH",))
+                    return set()
+
+                commands = [("MULTI",)]
+                commands += [("PEXPIRE", key, int(ttl * 1000)) for _, key in held]
+                commands.append(("EXEC",))
+                replies = await send(*commands)
+                if replies[-1] is not None:
+                    return {game for game, _ in held}
+
+    async def release_lease(self, key: GameKey, owner: str):
+        lease_key = self._lease_key(key)
+        async with self.client.exclusive() as send:
+            _, holder = await send(("WATCH", lease_key), ("GET", lease_key))
+            if holder is None or holder.decode() != owner:
+                await send(("UNWATCH",))
+                return
+            await send(("MULTI",), ("DEL", lease_key), ("EXEC",))
+
+    async def unleased(self, keys: Iterable[GameKey]) -> List[GameKey]:
+        """One MGET of the lease keys, so a sweep of many games is a single round-trip"""
+        games = list(keys)
+        if not games:
+            return []
+        holders = await self.client.execute("MGET", *(self._lease_key(key) for key in games))
+        return [game for game, holder in zip(games, holders) if holder is None]
+
+    async def close(self):
+        await self.client.close()
+
+
+def create_backend(config: Optional[dict] = None) -> StateBackend:
+    """Build the backend selected in configuration"""
+    config = config or STATE_CONFIG
+    if config["backend"] == "redis":
+        return RedisBackend(config["redis_url"], config["key_prefix"])
+    return InMemoryBackend()
@@ -0,0 +1,301 @@
+"""
+Tracing - Lightweight per-game trace spans exported to JSON lines
+
+A sampled game gets one trace: a span per phase (registration and each
+discussion and voting round) with child spans for timers, vote
+processing, outbound API calls and handler invocations. The current span
+is kept in a context variable, so spans opened in a handler or a timer
+task become children of it. Finished spans are buffered in memory and
+written to a local JSONL file by a background task.
+
+Usage:
+    python tracing.py logs/traces.jsonl   # latency per span name and phase
+"""
+
+import asyncio
+import contextvars
+import functools
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+from config import TRACING_CONFIG
+from game_state import GameKey
+
+logger = logging.getLogger(__name__)
+
+
+def _new_id() -> str:
+    return f"{random.getrandbits(64):016x}"
+
+
+class Span:
+    """A timed operation within a game trace"""
+
+    __slots__ = ("tracer", "trace_id", "span_id", "parent_id", "name", "key", "round",
+                 "start", "duration", "attrs", "_started", "_token")
+
+    def __init__(self, tracer: "Tracer", name: str, trace_id: str, parent_id: Optional[str],
+                 key: Optional[GameKey], round_number: Optional[int], attrs: dict):
+        self.tracer = tracer
+        self.trace_id = trace_id
+        self.span_id = _new_id()
+        self.parent_id = parent_id
+        self.name = name
+        self.key = key
+        self.round = round_number
+        self.attrs = attrs
+        self.start = time.time()
+        self.duration: Optional[float] = None
+        self._started = time.perf_counter()
+        self._token = None
+
+    def set(self, **attrs):
+        """Add attributes to the span"""
+        self.attrs.update(attrs)
+
+    def end(self):
+        if self.duration is None:
+            self.duration = time.perf_counter() - self._started
+            self.tracer._record(self)
+
+    def __enter__(self) -> "Span":
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_span.reset(self._token)
+        if exc is not None and not isinstance(exc, asyncio.CancelledError):
+            self.attrs["error"] = f"{exc_type.__name__}: {exc}"
+        self.end()
+
+    def to_dict(self) -> dict:
+        record = {
+            "trace": self.trace_id,
+            "span": self.span_id,
+            "parent": self.parent_id,
+            "name": self.name,
+            "chat_id": self.key.chat_id if self.key else None,
+            "thread_id": self.key.thread_id if self.key else None,
+            "round": self.round,
+            "start": round(self.start, 6),
+            "ms": round(self.duration * 1000, 3),
+        }
+        record.update(self.attrs)
+        return record
+
+
+class _NullSpan:
+    """Stand-in for spans of games that are not sampled"""
+
+    def set(self, **attrs):
+        pass
+
+    def end(self):
+        pass
+
+    def __enter__(self) -> "_NullSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("current_span", default=None)
+
+
+class Tracer:
+    """Creates spans for sampled games and exports finished ones"""
+
+    def __init__(self, sample_rate: float = 0.0, path: Optional[str] = None,
+                 buffer_size: int = 10000, max_bytes: int = 0):
+        self.sample_rate = sample_rate
+        self.path = path
+        self.max_bytes = max_bytes
+        self.buffer: Deque[Span] = deque(maxlen=buffer_size)
+        self.dropped = 0
+        self._traces: Dict[GameKey, str] = {}  # game -> trace id of sampled games
+        self._phases: Dict[GameKey, Span] = {}  # game -> open phase span
+        self._flush_task: Optional[asyncio.Task] = None
+        self._write_lock = threading.Lock()
+
+    # Game lifecycle
+
+    def start_game(self, key: GameKey):
+        """Decide whether a new or taken-over game is traced"""
+        self.end_game(key)
+        if self.sample_rate and random.random() < self.sample_rate:
+            self._traces[key] = _new_id()
+
+    def start_phase(self, key: GameKey, phase: str, round_number: int, **attrs):
+        """End the current phase span of a game and open one for the new phase"""
+        previous = self._phases.pop(key, None)
+        if previous is not None:
+            previous.end()
+        trace_id = self._traces.get(key)
+        if trace_id is not None:
+            self._phases[key] = Span(self, f"phase.{phase}", trace_id, None, key, round_number, attrs)
+
+    def end_game(self, key: GameKey, **attrs):
+        """Close the trace of a game"""
+        previous = self._phases.pop(key, None)
+        if previous is not None:
+            previous.set(**attrs)
+            previous.end()
+        self._traces.pop(key, None)
+
+    # Spans
+
+    def span(self, name: str, key: Optional[GameKey] = None, **attrs):
+        """Child span of the running span, or of the game's current phase.
+
+        A span that has already ended, such as the handler that started a
+        timer task, is not used as a parent; the phase span is.
+        """
+        parent = _current_span.get()
+        if parent is None or parent.duration is not None:
+            parent = self._phases.get(key) if key is not None else None
+        if parent is None:
+            return NULL_SPAN
+        if key is None:
+            key = parent.key
+        return Span(self, name, parent.trace_id, parent.span_id, key, parent.round, attrs)
+
+    def root_span(self, name: str, key: Optional[GameKey] = None, **attrs):
+        """Span that starts its own sampled trace when there is no game trace to join"""
+        span = self.span(name, key, **attrs)
+        if span is NULL_SPAN and key not in self._traces and self.sample_rate \
+                and random.random() < self.sample_rate:
+            span = Span(self, name, _new_id(), None, key, None, attrs)
+        return span
+
+    # Export
+
+    def _record(self, span: Span):
+        if len(self.buffer) == self.buffer.maxlen:
+            self.dropped += 1
+        self.buffer.append(span)
+
+    def _write(self):
+        with self._write_lock:
+            spans: List[Span] = []
+            while self.buffer:
+                spans.append(self.buffer.popleft())
+            if not spans or not self.path:
+                return
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            if self.max_bytes and os.path.exists(self.path) and os.path.getsize(self.path) > self.max_bytes:
+                os.replace(self.path, f"{self.path}.1")
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write("".join(json.dumps(span.to_dict(), ensure_ascii=False) + "\n" for span in spans))
+
+    def flush(self):
+        """Write buffered spans now"""
+        try:
+            self._write()
+        except OSError as e:
+            logger.error("Could not write traces to %s: %s", self.path, e)
+
+    async def _flush_loop(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            if self.buffer:
+                try:
+                    await asyncio.to_thread(self._write)
+                except OSError as e:
+                    logger.error("Could not write traces to %s: %s", self.path, e)
+
+    def start(self, interval: float):
+        """Start exporting finished spans in the background"""
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop(interval))
+
+    def close(self):
+        """Stop background exports and write what is buffered"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        self.flush()
+        if self.dropped:
+            logger.warning("Dropped %s trace spans because the buffer was full", self.dropped)
+
+
+# Disabled until setup_tracing() is called, so tools and benchmarks pay only for no-op spans
+tracer = Tracer()
+
+
+def setup_tracing(config: Optional[dict] = None) -> Tracer:
+    """Configure the shared tracer and start exporting spans; needs a running event loop"""
+    config = config or TRACING_CONFIG
+    tracer.sample_rate = config["sample_rate"]
+    tracer.path = config["file"]
+    tracer.max_bytes = config["max_bytes"]
+    tracer.buffer = deque(tracer.buffer, maxlen=config["buffer_size"])
+    if tracer.sample_rate:
+        tracer.start(config["flush_interval"])
+    return tracer
+
+
+def shutdown_tracing():
+    tracer.close()
+
+
+def traced_handler(callback):
+    """Wrap a bot handler so each invocation gets a span"""
+    name = f"handler.{callback.__name__}"
+
+    @functools.wraps(callback)
+    async def handle(update, context):
+        message = update.effective_message
+        with tracer.root_span(name, GameKey.of_message(message) if message else None):
+            return await callback(update, context)
+    return handle
+
+
+def summarize(path: str) -> List[dict]:
+    """Latency per span name and game phase from an exported trace file"""
+    with open(path, encoding="utf-8") as f:
+        spans = [json.loads(line) for line in f if line.strip()]
+
+    by_id = {span["span"]: span for span in spans}
+    groups: Dict[tuple, List[float]] = {}
+    for span in spans:
+        # Walk up to the phase the span happened in
+        phase, parent = span["name"], span
+        while parent is not None and not parent["name"].startswith("phase."):
+            parent = by_id.get(parent["parent"])
+        if parent is not None:
+            phase = parent["name"][len("phase."):]
+        groups.setdefault((span["name"], phase), []).append(span["ms"])
+
+    rows = []
+    for (name, phase), durations in groups.items():
+        durations.sort()
+        rows.append({
+            "name": name,
+            "phase": phase,
+            "count": len(durations),
+            "p50_ms": durations[len(durations) // 2],
+            "p95_ms": durations[min(len(durations) - 1, int(len(durations) * 0.95))],
+            "max_ms": durations[-1],
+        })
+    rows.sort(key=lambda row: row["p95_ms"] * row["count"], reverse=True)
+    return rows
+
+
+if __name__ == "__main__":
+    trace_file = sys.argv[1] if len(sys.argv) > 1 else TRACING_CONFIG["file"]
+    print(f"{'span':<32} {'phase':<14} {'count':>7} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9}")
+    for row in summarize(trace_file):
+        print(f"{row['name']:<32} {row['phase']:<14} {row['count']:>7} {row['p50_ms']:>9.1f} "
+              f"{row['p95_ms']:>9.1f} {row['max_ms']:>9.1f}")